@@ -15,6 +15,41 @@ uint32_t adc_read_channel(uint8_t chan)
 	return asense_result_read();
 }
 
+/* settle != 0 ends the charge phase once the comparator has read low for that many cycles */
+void adc_set_timing(uint32_t setup, uint32_t charge, uint32_t discharge, uint16_t settle)
+{
+    asense_setup_write(setup);
+    asense_charge_write(charge);
+    asense_discharge_write(discharge);
+    asense_mode_write(((settle ? 1 : 0) << CSR_ASENSE_MODE_EARLY_OFFSET) |
+            (settle << CSR_ASENSE_MODE_SETTLE_OFFSET));
+}
+
+/* Convert every channel in mask in the background, lowest first */
+void adc_scan_start(uint16_t mask)
+{
+    asense_scan_write((mask << CSR_ASENSE_SCAN_MASK_OFFSET) |
+            (1 << CSR_ASENSE_SCAN_START_OFFSET));
+}
+
+int adc_scan_busy(void)
+{
+    return (asense_scan_status_read() >> CSR_ASENSE_SCAN_STATUS_BUSY_OFFSET) & 1;
+}
+
+/* Returns 1 and pops the oldest scan result if there is one, 0 otherwise */
+int adc_scan_read(uint8_t *chan, uint32_t *result)
+{
+    if(!((asense_scan_status_read() >> CSR_ASENSE_SCAN_STATUS_READABLE_OFFSET) & 1))
+        return 0;
+
+    uint32_t r = asense_scan_result_read();
+    *chan = (r >> CSR_ASENSE_SCAN_RESULT_CHAN_OFFSET) & ((1 << CSR_ASENSE_SCAN_RESULT_CHAN_SIZE) - 1);
+    *result = (r >> CSR_ASENSE_SCAN_RESULT_RESULT_OFFSET) & ((1 << CSR_ASENSE_SCAN_RESULT_RESULT_SIZE) - 1);
+    asense_scan_pop_write(1 << CSR_ASENSE_SCAN_POP_POP_OFFSET);
+    return 1;
+}
+
 uint32_t adc_count_to_mv(uint32_t value, uint32_t cal){
     return (value / cal);
 }
\ No newline at end of file
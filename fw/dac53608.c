@@ -19,7 +19,7 @@ static bool dac_read(uint8_t addr, uint16_t* d)
 	char data[2] = {0};
 
 	bool ret = i2c_read(DAC_I2C_ADDR, addr, data, 2, false);
-	*d = data[0] << 8 | data[1];
+	*d = (uint8_t)data[0] << 8 | (uint8_t)data[1];
 
 	return ret;
 }
@@ -29,6 +29,44 @@ bool dac_write_channel(uint8_t index, uint16_t val)
 	return dac_write(index+8, val);
 }
 
+/* Set by the first dac_write_channels(): 1 if the block write took, 0 if it didn't */
+static int block_write = -1;
+
+/* Channels index..index+count-1 in one transaction, relying on the register
+ * address incrementing from one DAC data register to the next. That isn't
+ * checked against the datasheet, so the first call reads the registers back.
+ * Returns false if the write failed or the DAC doesn't take block writes,
+ * the caller then falls back to dac_write_channel() */
+bool dac_write_channels(uint8_t index, const uint16_t *vals, uint8_t count)
+{
+	char data[16];
+
+	if(index + count > 8 || block_write == 0)
+		return false;
+
+	for(int i = 0; i < count; i++) {
+		data[2*i] = vals[i] >> 8;
+		data[2*i+1] = vals[i] & 0xFF;
+	}
+
+	if(!i2c_write(DAC_I2C_ADDR, index+8, data, 2*count))
+		return false;
+
+	if(block_write < 0) {
+		block_write = 1;
+		for(int i = 0; i < count; i++) {
+			uint16_t d;
+			/* Bits 11:4 are data on the 8 bit DAC43608 as well */
+			if(!dac_read(index+8+i, &d) || ((d ^ vals[i]) & 0x0ff0)) {
+				block_write = 0;
+				return false;
+			}
+		}
+	}
+
+	return true;
+}
+
 void dac_reset()
 {
 
@@ -0,0 +1,81 @@
+/* This file is part of OrangeCrab-test
+ *
+ * Copyright 2020 Gregory Davill <greg.davill@gmail.com> 
+ */
+
+#include <stdio.h>
+#include <uart.h>
+
+#include <frames.h>
+#include <sleep.h>
+
+static int frames_enabled = 0;
+
+static uint16_t crc16_ccitt(uint16_t crc, uint8_t b)
+{
+	crc ^= b << 8;
+	for(int i = 0; i < 8; i++)
+		crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+	return crc;
+}
+
+static void frame_send(uint8_t type, uint8_t chan, const uint32_t *values, uint8_t count)
+{
+	uint8_t header[3] = {type, chan, count};
+	uint16_t crc = 0xffff;
+
+	/* Straight to the UART, putchar() would expand 0x0a */
+	uart_write(FRAME_SYNC);
+	for(int i = 0; i < 3; i++) {
+		uart_write(header[i]);
+		crc = crc16_ccitt(crc, header[i]);
+	}
+	for(int i = 0; i < count; i++) {
+		for(int j = 0; j < 32; j += 8) {
+			uart_write(values[i] >> j);
+			crc = crc16_ccitt(crc, values[i] >> j);
+		}
+	}
+	uart_write(crc & 0xff);
+	uart_write(crc >> 8);
+}
+
+/* Offer frames to the host until it takes them up or declines. The host may
+ * not have the port open yet, so the offer is repeated; hosts that don't know
+ * about frames never answer, for them it runs out after FRAMES_OFFER_MS */
+void frames_negotiate(void)
+{
+	for(int i = 0; i < FRAMES_OFFER_MS; i++) {
+		if(i % FRAMES_OFFER_PERIOD_MS == 0)
+			printf("Info:frames 1\n");
+		while(uart_read_nonblock()) {
+			char c = uart_read();
+			if(c == FRAME_REQUEST) {
+				frames_enabled = 1;
+				printf("Info:frames on\n");
+				return;
+			}
+			if(c == FRAME_DECLINE)
+				return;
+		}
+		msleep(1);
+	}
+}
+
+void report_dac_adc(uint8_t chan, uint32_t dac, uint32_t adc)
+{
+	if(frames_enabled) {
+		uint32_t values[2] = {dac, adc};
+		frame_send(FRAME_DAC_ADC, chan, values, 2);
+	} else {
+		printf("CH=%d, DAC=%ld, ADC=%ld\n", chan, dac, adc);
+	}
+}
+
+void report_adc(uint8_t chan, const char *name, uint32_t adc)
+{
+	if(frames_enabled)
+		frame_send(FRAME_ADC, chan, &adc, 1);
+	else
+		printf("ADC-%s=%ld\n", name, adc);
+}
@@ -4,6 +4,45 @@
 
 #include <stdint.h>
 
+/* Phase durations in 48MHz cycles, the gateware's reset values */
+#define ADC_SETUP_DEFAULT       0x8000
+#define ADC_CHARGE_DEFAULT      0x8000
+#define ADC_DISCHARGE_DEFAULT   0x20000
+
+/* For the DAC sweep only. In `hw/analogsim.py --study` early termination on its own
+ * takes the sweep from 786ms to 679ms, the shorter setup and discharge to 421ms. What
+ * they leave on the capacitor biases the next conversion, and in the staggered scan
+ * the next channel sits far from the last one: the worst channel error goes from 0.0%
+ * to 1.2% of the 20% limit and the worst rail error from 0.0% to 0.7% of 25%. A
+ * 0xc000 discharge (223ms) already reaches 13.7%. The rails and the battery test go
+ * back to the reset values, the battery test samples the charger's response over time
+ * and its thresholds assume that pace. */
+#define ADC_SETUP_FAST          0x400
+#define ADC_CHARGE_FAST         0x8000
+#define ADC_DISCHARGE_FAST      0x18000
+#define ADC_SETTLE_FAST         64
+
+/* DAC sweep of the ADC test: 1 programs all six DACs in one I2C write per step and
+ * scans their ADC channels, 0 ramps one channel at a time as before */
+#ifndef ADC_SWEEP_BATCH
+#define ADC_SWEEP_BATCH         1
+#endif
+#define ADC_SWEEP_STEPS         32      /* DAC codes 0 to 0xf80, in steps of 0x80 */
+#define ADC_SWEEP_STAGGER       5       /* Steps between the codes of neighbouring channels */
+
+#define ADC_CHAN_GND    0
+#define ADC_CHAN_VREF   7
+#define ADC_CHAN_3V3    8
+#define ADC_CHAN_1V35   12
+#define ADC_CHAN_2V5    13
+#define ADC_CHAN_1V1    14
+#define ADC_CHAN_VBAT   15
+
 uint32_t adc_read_channel(uint8_t chan);
+void adc_set_timing(uint32_t setup, uint32_t charge, uint32_t discharge, uint16_t settle);
+
+void adc_scan_start(uint16_t mask);
+int adc_scan_busy(void);
+int adc_scan_read(uint8_t *chan, uint32_t *result);
 
 #endif
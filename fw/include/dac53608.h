@@ -9,5 +9,6 @@
 void dac_reset();
 bool dac_read_id();
 bool dac_write_channel(uint8_t index, uint16_t val);
+bool dac_write_channels(uint8_t index, const uint16_t *vals, uint8_t count);
 
 #endif
@@ -0,0 +1,31 @@
+/* This file is part of OrangeCrab-test
+ *
+ * Copyright 2020 Gregory Davill <greg.davill@gmail.com> 
+ */
+
+#ifndef DDRTEST_H__
+#define DDRTEST_H__
+
+/* sdrinit_0() is only built with DDR3_INIT_OWN=1 in fw/Makefile, otherwise
+ * main.c uses liblitedram's sdram_init() */
+#ifndef DDR3_INIT_OWN
+#define DDR3_INIT_OWN   0
+#endif
+
+/* Memtest profiles run by sdrinit_0() after leveling, OR them together */
+#define MEMTEST_QUICK   (1 << 0)    /* Address and data line walks, stuck and bridged lines */
+#define MEMTEST_SPARSE  (1 << 1)    /* LFSR data in one cache line per 4kB, across all banks and rows */
+#define MEMTEST_FULL    (1 << 2)    /* Every word, as the litex BIOS does */
+
+#ifndef DDR3_MEMTEST
+#define DDR3_MEMTEST    (MEMTEST_QUICK | MEMTEST_SPARSE)
+#endif
+
+/* How long sdrinit_0() waits for the host's answer to "Info:ddr3-level?", in ms */
+#ifndef DDR3_LEVEL_TIMEOUT_MS
+#define DDR3_LEVEL_TIMEOUT_MS   2000
+#endif
+
+int sdrinit_0(void);
+
+#endif
@@ -0,0 +1,31 @@
+/* This file is part of OrangeCrab-test
+ *
+ * Copyright 2020 Gregory Davill <greg.davill@gmail.com> 
+ */
+
+#ifndef FRAMES_H__
+#define FRAMES_H__
+
+#include <stdint.h>
+
+/* Binary measurement frames, the host side is sw/octest/frames.py
+ *   SYNC | type | chan | count | count x uint32 LE | CRC-16/CCITT LE over type..values */
+#define FRAME_SYNC      0xa5
+#define FRAME_REQUEST   'F'     /* Host's answer to "Info:frames 1": frames please */
+#define FRAME_DECLINE   'T'     /* or text */
+
+/* How long the offer stands, and how often it is repeated, in ms */
+#ifndef FRAMES_OFFER_MS
+#define FRAMES_OFFER_MS         5000
+#endif
+#define FRAMES_OFFER_PERIOD_MS  100
+
+#define FRAME_DAC_ADC   1   /* chan = DAC channel, values = DAC code, ADC result */
+#define FRAME_ADC       2   /* chan = ADC mux channel, values = ADC result */
+
+void frames_negotiate(void);
+
+void report_dac_adc(uint8_t chan, uint32_t dac, uint32_t adc);
+void report_adc(uint8_t chan, const char *name, uint32_t adc);
+
+#endif
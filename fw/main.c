@@ -17,6 +17,8 @@
 #include <dac53608.h>
 #include <mcp23s08.h>
 #include <asense.h>
+#include <frames.h>
+#include <ddrtest.h>
 
 #include <sleep.h>
 #include <flash-spi.h>
@@ -51,6 +53,9 @@ int main(int i, char **c)
 	printf("Info:migen "MIGEN_GIT_SHA1"\n");
 	printf("Info:litex "LITEX_GIT_SHA1"\n");
 
+	/* Measurements as binary frames, if the host asks for them */
+	frames_negotiate();
+
 
 
 
@@ -83,7 +88,11 @@ int main(int i, char **c)
 
 	printf("Test:DDR3 Start\n");
 	/* Init Memory */
+#if DDR3_INIT_OWN
+	int sdr_ok = sdrinit_0();
+#else
 	int sdr_ok = sdram_init();
+#endif
 	if(sdr_ok == 0){
 		test_fail("Test:DDR3|Fail");
 		//self_reset_out_write(0xAA550001);
@@ -141,25 +150,70 @@ int main(int i, char **c)
 
 
 	printf("Test:ADC, Start\n");
+	adc_set_timing(ADC_SETUP_FAST, ADC_CHARGE_FAST, ADC_DISCHARGE_FAST, ADC_SETTLE_FAST);
+	printf("Info:adc-timing %x,%x,%x,%d\n", ADC_SETUP_FAST, ADC_CHARGE_FAST, ADC_DISCHARGE_FAST, ADC_SETTLE_FAST);
+	printf("Test:ADC-SWEEP, Start\n");
+#if ADC_SWEEP_BATCH
+	/* ramp all DAC outputs at once, each channel a few steps ahead of the one
+	 * before so a swapped or shorted channel doesn't read back its own code */
+	for(int s = 0; s < ADC_SWEEP_STEPS; s++) {
+		uint16_t codes[6];
+		for(int i = 0; i < 6; i++)
+			codes[i] = ((s + i*ADC_SWEEP_STAGGER) % ADC_SWEEP_STEPS) * 0x80;
+		if(!dac_write_channels(0, codes, 6))
+			for(int i = 0; i < 6; i++)
+				dac_write_channel(i, codes[i]);
+
+		/* Perform ADC measurements, A0..A5 */
+		adc_scan_start(0x3f << 1);
+		for(;;) {
+			uint8_t chan;
+			uint32_t result;
+			int busy = adc_scan_busy();
+			if(adc_scan_read(&chan, &result))
+				report_dac_adc(chan-1, codes[chan-1], result);
+			else if(!busy)
+				break;
+		}
+	}
+	/* Disable channels once tested */
+	const uint16_t off[6] = {0};
+	if(!dac_write_channels(0, off, 6))
+		for(int i = 0; i < 6; i++)
+			dac_write_channel(i, 0);
+#else
 	/* ramp up counts to DAC outputs */
 	for(int i = 0; i < 6; i++) {
 		for(int j = 0; j < 0x0fff; j+=0x80) {
-			printf("CH=%d, DAC=%d, ",i, j);
 			dac_write_channel(i, j);
 			/* Perform ADC measurements */
-			printf("ADC=%ld\n", adc_read_channel(i+1));
+			report_dac_adc(i, j, adc_read_channel(i+1));
 		}
 		/* Disable channel  once tested */
 		dac_write_channel(i, 0);
 	}
-
-	printf("ADC-GND=%ld\n", adc_read_channel(0));
-	printf("ADC-VREF=%ld\n", adc_read_channel(7));
-	printf("ADC-3V3=%ld\n", adc_read_channel(8));
-	printf("ADC-1V35=%ld\n", adc_read_channel(12));
-	printf("ADC-2V5=%ld\n", adc_read_channel(13));
-	printf("ADC-1V1=%ld\n", adc_read_channel(14));
-	printf("ADC-VBAT=%ld\n", adc_read_channel(15));
+#endif
+	printf("Test:ADC-SWEEP, Finish\n");
+
+	/* Rails and battery with the reset timings, see asense.h */
+	adc_set_timing(ADC_SETUP_DEFAULT, ADC_CHARGE_DEFAULT, ADC_DISCHARGE_DEFAULT, 0);
+
+	/* Rails are scanned by the gateware, each one is printed while the next converts */
+	const char *rail_names[16] = {
+		[ADC_CHAN_GND] = "GND", [ADC_CHAN_VREF] = "VREF", [ADC_CHAN_3V3] = "3V3", [ADC_CHAN_1V35] = "1V35",
+		[ADC_CHAN_2V5] = "2V5", [ADC_CHAN_1V1] = "1V1", [ADC_CHAN_VBAT] = "VBAT",
+	};
+	adc_scan_start(1 << ADC_CHAN_GND | 1 << ADC_CHAN_VREF | 1 << ADC_CHAN_3V3 | 1 << ADC_CHAN_1V35 |
+			1 << ADC_CHAN_2V5 | 1 << ADC_CHAN_1V1 | 1 << ADC_CHAN_VBAT);
+	for(;;) {
+		uint8_t chan;
+		uint32_t result;
+		int busy = adc_scan_busy();
+		if(adc_scan_read(&chan, &result))
+			report_adc(chan, rail_names[chan], result);
+		else if(!busy)
+			break;
+	}
 	printf("Test:ADC, Finish\n");
 
 	printf("Test:BATT, Start\n");
@@ -170,7 +224,7 @@ int main(int i, char **c)
 	mcp23s08_write(0x9, 1 << 6 | 1 << 7);
 	for(int i = 0; i < 20; i++){
 		msleep(1);
-		printf("ADC-VBAT=%ld\n", adc_read_channel(15));
+		report_adc(ADC_CHAN_VBAT, "VBAT", adc_read_channel(ADC_CHAN_VBAT));
 	}
 
 	printf("BATT: Remove Dummy Battery\n");
@@ -178,7 +232,7 @@ int main(int i, char **c)
 	mcp23s08_write(0x9, 1 << 7);
 	for(int i = 0; i < 20; i++){
 		msleep(1);
-		printf("ADC-VBAT=%ld\n", adc_read_channel(15));
+		report_adc(ADC_CHAN_VBAT, "VBAT", adc_read_channel(ADC_CHAN_VBAT));
 	}
 
 	/* Enable current sink */
@@ -186,7 +240,7 @@ int main(int i, char **c)
 	mcp23s08_write(0x9, 0);
 	for(int i = 0; i < 20; i++){
 		msleep(1);
-		printf("ADC-VBAT=%ld\n", adc_read_channel(15));
+		report_adc(ADC_CHAN_VBAT, "VBAT", adc_read_channel(ADC_CHAN_VBAT));
 	}
 	printf("Test:BATT, Finish\n");
 
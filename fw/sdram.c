@@ -13,16 +13,27 @@
 
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
 #include <memtest.h>
 #include <lfsr.h>
 
 #ifdef CSR_SDRAM_BASE
 #include <generated/sdram_phy.h>
+
+/* Settings found by leveling, reported to the host and handed back by it on a retest */
+static struct {
+	int cdly;
+	int bitslip[SDRAM_PHY_MODULES];
+	int rdelay[SDRAM_PHY_MODULES];
+	int wdelay[SDRAM_PHY_MODULES];
+} level;
 #endif
 #include <generated/mem.h>
 #include <system.h>
 
-//#include "sdram.h"
+#include <ddrtest.h>
+#include <uart.h>
+#include <sleep.h>
 
 __attribute__((unused)) static void cdelay(int i)
 {
@@ -34,6 +45,52 @@ __attribute__((unused)) static void cdelay(int i)
 #endif
 }
 
+/* Cycles spent in each phase of sdrinit_0(), timer0 counts down from its load value */
+static void phase_timer_start(void)
+{
+	timer0_en_write(0);
+	timer0_reload_write(0);
+	timer0_load_write(0xffffffff);
+	timer0_en_write(1);
+}
+
+static unsigned int phase_timer_read(void)
+{
+	timer0_update_value_write(1);
+	return 0xffffffff - timer0_value_read();
+}
+
+#define ONEZERO 0xAAAAAAAA
+#define ZEROONE 0x55555555
+
+/* Words in one L2 cache line, a full 128 bit DDR3 x16 burst. Tests write whole lines
+ * at a time so the L2 can evict them as bursts without reading them in first. */
+#define LINE_WORDS 4
+
+/* Bytes of memory tested for each tap during read leveling */
+#define READ_LEVEL_TEST_SIZE (1024*4)
+
+/* Taps either side of a cached read delay that have to work for it to be used */
+#define READ_LEVEL_VERIFY_MARGIN 4
+
+static inline void write_line(volatile unsigned int *line, unsigned int a, unsigned int b)
+{
+	line[0] = a;
+	line[1] = b;
+	line[2] = a;
+	line[3] = b;
+}
+
+static void flush_caches(void)
+{
+	flush_cpu_dcache();
+#ifdef CONFIG_L2_SIZE
+	flush_l2_cache();
+#endif
+}
+
+
+
 #ifdef CSR_SDRAM_BASE
 
 #define DFII_ADDR_SHIFT CONFIG_CSR_ALIGNMENT/8
@@ -42,17 +99,17 @@ __attribute__((unused)) static void cdelay(int i)
 
 #define DFII_PIX_DATA_BYTES DFII_PIX_DATA_SIZE*CSR_DATA_BYTES
 
-void sdrsw(void)
+static void sdrsw(void)
 {
 	sdram_dfii_control_write(DFII_CONTROL_CKE|DFII_CONTROL_ODT|DFII_CONTROL_RESET_N);
 }
 
-void sdrhw(void)
+static void sdrhw(void)
 {
 	sdram_dfii_control_write(DFII_CONTROL_SEL);
 }
 
-void sdrrow(unsigned int row)
+__attribute__((unused)) static void sdrrow(unsigned int row)
 {
 	if(row == 0) {
 		sdram_dfii_pi0_address_write(0x0000);
@@ -67,7 +124,7 @@ void sdrrow(unsigned int row)
 	}
 }
 
-void sdrrdbuf(int dq)
+__attribute__((unused)) static void sdrrdbuf(int dq)
 {
 	int i, p;
 	int first_byte, step;
@@ -90,7 +147,7 @@ void sdrrdbuf(int dq)
 	printf("\n");
 }
 
-void sdrrd(unsigned int addr, int dq)
+__attribute__((unused)) static void sdrrd(unsigned int addr, int dq)
 {
 	sdram_dfii_pird_address_write(addr);
 	sdram_dfii_pird_baddress_write(0);
@@ -99,7 +156,7 @@ void sdrrd(unsigned int addr, int dq)
 	sdrrdbuf(dq);
 }
 
-void sdrrderr(int count)
+__attribute__((unused)) static void sdrrderr(int count)
 {
 	int addr;
 	int i, j, p;
@@ -144,7 +201,7 @@ void sdrrderr(int count)
 	printf("\n");
 }
 
-void sdrwr(unsigned int addr)
+__attribute__((unused)) static void sdrwr(unsigned int addr)
 {
 	int i, p;
 	unsigned char buf[DFII_PIX_DATA_BYTES];
@@ -164,7 +221,7 @@ void sdrwr(unsigned int addr)
 #ifdef CSR_DDRPHY_BASE
 
 #ifdef SDRAM_PHY_WRITE_LEVELING_CAPABLE
-void sdrwlon(void)
+static void sdrwlon(void)
 {
 	sdram_dfii_pi0_address_write(DDRX_MR1 | (1 << 7));
 	sdram_dfii_pi0_baddress_write(1);
@@ -179,7 +236,7 @@ void sdrwlon(void)
 	ddrphy_wlevel_en_write(1);
 }
 
-void sdrwloff(void)
+static void sdrwloff(void)
 {
 	sdram_dfii_pi0_address_write(DDRX_MR1);
 	sdram_dfii_pi0_baddress_write(1);
@@ -374,7 +431,7 @@ static void write_level_cdly_range(unsigned int *best_error, int *best_cdly,
 	}
 }
 
-int write_level(void)
+static int write_level(void)
 {
 	int delays[SDRAM_PHY_MODULES];
 	unsigned int best_error = ~0u;
@@ -416,6 +473,7 @@ int write_level(void)
 	printf("| best: %d\n", best_cdly);
 
 	/* if we found any working delay then set it */
+	level.cdly = best_cdly;
 	if (best_cdly >= 0) {
 		ddrphy_cdly_rst_write(1);
 		for (int i = 0; i < best_cdly; ++i) {
@@ -429,6 +487,8 @@ int write_level(void)
 	/* re-run write leveling the final time */
 	if (!write_level_scan(delays, 128, 1))
 		return 0;
+	for (int i = 0; i < SDRAM_PHY_MODULES; ++i)
+		level.wdelay[i] = delays[i];
 
 	return best_cdly >= 0;
 }
@@ -501,12 +561,7 @@ static unsigned int seed_to_data_32(unsigned int seed, int random)
 
 
 
-#define ONEZERO 0xAAAAAAAA
-#define ZEROONE 0x55555555
-
-
-
-int memtest_bus_0(unsigned int *addr, unsigned long size)
+__attribute__((unused)) static int memtest_bus_0(unsigned int *addr, unsigned long size)
 {
 	volatile unsigned int *array = addr;
 	int i, errors;
@@ -514,13 +569,9 @@ int memtest_bus_0(unsigned int *addr, unsigned long size)
 
 	errors = 0;
 
-	for(i = 0; i < size/4;i++) {
-		array[i] = ONEZERO;
-	}
-	flush_cpu_dcache();
-#ifdef CONFIG_L2_SIZE
-	flush_l2_cache();
-#endif
+	for(i = 0; i < size/4; i += LINE_WORDS)
+		write_line(&array[i], ONEZERO, ONEZERO);
+	flush_caches();
 	for(i = 0; i < size/4; i++) {
 		rdata = array[i];
 		if(rdata != ONEZERO) {
@@ -531,13 +582,9 @@ int memtest_bus_0(unsigned int *addr, unsigned long size)
 		}
 	}
 
-	for(i = 0; i < size/4; i++) {
-		array[i] = ZEROONE;
-	}
-	flush_cpu_dcache();
-#ifdef CONFIG_L2_SIZE
-	flush_l2_cache();
-#endif
+	for(i = 0; i < size/4; i += LINE_WORDS)
+		write_line(&array[i], ZEROONE, ZEROONE);
+	flush_caches();
 	for(i = 0; i < size/4; i++) {
 		rdata = array[i];
 		if(rdata != ZEROONE) {
@@ -552,7 +599,7 @@ int memtest_bus_0(unsigned int *addr, unsigned long size)
 }
 
 
-int memtest_data_0(unsigned int *addr, unsigned long size, int random)
+static int memtest_data_0(unsigned int *addr, unsigned long size, int random)
 {
 	volatile unsigned int *array = addr;
 	int i, errors;
@@ -562,17 +609,18 @@ int memtest_data_0(unsigned int *addr, unsigned long size, int random)
 	errors = 0;
 	seed_32 = 1;
 
-	for(i = 0; i < size/4; i++) {
-		seed_32 = seed_to_data_32(seed_32, random);
-		array[i] = seed_32;
-		
+	for(i = 0; i < size/4; i += LINE_WORDS) {
+		unsigned int d[LINE_WORDS];
+		for(int j = 0; j < LINE_WORDS; j++)
+			d[j] = seed_32 = seed_to_data_32(seed_32, random);
+		array[i+0] = d[0];
+		array[i+1] = d[1];
+		array[i+2] = d[2];
+		array[i+3] = d[3];
 	}
-	
+
 	seed_32 = 1;
-	flush_cpu_dcache();
-#ifdef CONFIG_L2_SIZE
-	flush_l2_cache();
-#endif
+	flush_caches();
 	for(i = 0; i < size/4; i++) {
 		seed_32 = seed_to_data_32(seed_32, random);
 		rdata = array[i];
@@ -594,7 +642,7 @@ static int read_level_scan(int module, int bitslip)
 	unsigned char prs[SDRAM_PHY_PHASES][DFII_PIX_DATA_BYTES];
 	unsigned char tst[DFII_PIX_DATA_BYTES];
 	int p, i;
-	int score;
+	int score = 0;
 
 		sdrhw();
 	
@@ -610,7 +658,7 @@ static int read_level_scan(int module, int bitslip)
 		ddrphy_burstdet_clr_write(1);
 #endif
 		cdelay(15);
-		int test = memtest_data_0((unsigned int *) MAIN_RAM_BASE, 1024*32, 0);
+		int test = memtest_data_0((unsigned int *) MAIN_RAM_BASE, READ_LEVEL_TEST_SIZE, 0);
 
 #ifdef SDRAM_PHY_ECP5DDRPHY
 		if (test > 0)
@@ -628,16 +676,14 @@ static int read_level_scan(int module, int bitslip)
 	return score;
 }
 
-static void read_level(int module)
+/* Write a pseudo-random pattern to the start of row 0, leaving it open */
+static void read_level_pattern(unsigned char prs[SDRAM_PHY_PHASES][DFII_PIX_DATA_BYTES])
 {
 	unsigned int prv;
-	unsigned char prs[SDRAM_PHY_PHASES][DFII_PIX_DATA_BYTES];
-	unsigned char tst[DFII_PIX_DATA_BYTES];
 	int p, i;
-	int working;
-	int delay, delay_min, delay_max;
 
-	printf("delays: ");
+	/* read_level_scan() hands the bus to the controller, take it back for the DFII commands */
+	sdrsw();
 
 	/* Generate pseudo-random sequence */
 	prv = 42;
@@ -664,31 +710,62 @@ static void read_level(int module)
 	/* Calibrate each DQ in turn */
 	sdram_dfii_pird_address_write(0);
 	sdram_dfii_pird_baddress_write(0);
+}
+
+/* Read the pattern back at the current delay, 1 if 'module' gets it right */
+static int read_level_working(int module, unsigned char prs[SDRAM_PHY_PHASES][DFII_PIX_DATA_BYTES])
+{
+	unsigned char tst[DFII_PIX_DATA_BYTES];
+	int p;
+	int working;
 
-	/* Find smallest working delay */
-	delay = 0;
-	read_delay_rst(module);
-	while(1) {
 #ifdef SDRAM_PHY_ECP5DDRPHY
-		ddrphy_burstdet_clr_write(1);
+	ddrphy_burstdet_clr_write(1);
 #endif
-		command_prd(DFII_COMMAND_CAS|DFII_COMMAND_CS|DFII_COMMAND_RDDATA);
-		cdelay(15);
-		working = 1;
-		for(p=0;p<SDRAM_PHY_PHASES;p++) {
-			/* read back test pattern */
-			csr_rd_buf_uint8(sdram_dfii_pix_rddata_addr[p],
-					 tst, DFII_PIX_DATA_BYTES);
-			/* verify bytes matching current 'module' */
-			if (prs[p][  SDRAM_PHY_MODULES-1-module] != tst[  SDRAM_PHY_MODULES-1-module] ||
-			    prs[p][2*SDRAM_PHY_MODULES-1-module] != tst[2*SDRAM_PHY_MODULES-1-module])
-				working = 0;
-		}
-#ifdef SDRAM_PHY_ECP5DDRPHY
-		if (((ddrphy_burstdet_seen_read() >> module) & 0x1) != 1)
+	command_prd(DFII_COMMAND_CAS|DFII_COMMAND_CS|DFII_COMMAND_RDDATA);
+	cdelay(15);
+	working = 1;
+	for(p=0;p<SDRAM_PHY_PHASES;p++) {
+		/* read back test pattern */
+		csr_rd_buf_uint8(sdram_dfii_pix_rddata_addr[p],
+				 tst, DFII_PIX_DATA_BYTES);
+		/* verify bytes matching current 'module' */
+		if (prs[p][  SDRAM_PHY_MODULES-1-module] != tst[  SDRAM_PHY_MODULES-1-module] ||
+		    prs[p][2*SDRAM_PHY_MODULES-1-module] != tst[2*SDRAM_PHY_MODULES-1-module])
 			working = 0;
+	}
+#ifdef SDRAM_PHY_ECP5DDRPHY
+	if (((ddrphy_burstdet_seen_read() >> module) & 0x1) != 1)
+		working = 0;
 #endif
-		if(working)
+	return working;
+}
+
+static void read_level_precharge(void)
+{
+	/* Precharge */
+	sdram_dfii_pi0_address_write(0);
+	sdram_dfii_pi0_baddress_write(0);
+	command_p0(DFII_COMMAND_RAS|DFII_COMMAND_WE|DFII_COMMAND_CS);
+	cdelay(15);
+}
+
+/* Returns the delay it settled on, -1 if none worked */
+static int read_level(int module)
+{
+	unsigned char prs[SDRAM_PHY_PHASES][DFII_PIX_DATA_BYTES];
+	int i;
+	int delay, delay_min, delay_max;
+
+	printf("delays: ");
+
+	read_level_pattern(prs);
+
+	/* Find smallest working delay */
+	delay = 0;
+	read_delay_rst(module);
+	while(1) {
+		if(read_level_working(module, prs))
 			break;
 		delay++;
 		if(delay >= SDRAM_PHY_DELAYS)
@@ -710,26 +787,7 @@ static void read_level(int module)
 
 	/* Find largest working delay */
 	while(1) {
-#ifdef SDRAM_PHY_ECP5DDRPHY
-		ddrphy_burstdet_clr_write(1);
-#endif
-		command_prd(DFII_COMMAND_CAS|DFII_COMMAND_CS|DFII_COMMAND_RDDATA);
-		cdelay(15);
-		working = 1;
-		for(p=0;p<SDRAM_PHY_PHASES;p++) {
-			/* read back test pattern */
-			csr_rd_buf_uint8(sdram_dfii_pix_rddata_addr[p],
-					 tst, DFII_PIX_DATA_BYTES);
-			/* verify bytes matching current 'module' */
-			if (prs[p][  SDRAM_PHY_MODULES-1-module] != tst[  SDRAM_PHY_MODULES-1-module] ||
-			    prs[p][2*SDRAM_PHY_MODULES-1-module] != tst[2*SDRAM_PHY_MODULES-1-module])
-				working = 0;
-		}
-#ifdef SDRAM_PHY_ECP5DDRPHY
-		if (((ddrphy_burstdet_seen_read() >> module) & 0x1) != 1)
-			working = 0;
-#endif
-		if(!working)
+		if(!read_level_working(module, prs))
 			break;
 		delay++;
 		if(delay >= SDRAM_PHY_DELAYS)
@@ -748,11 +806,39 @@ static void read_level(int module)
 	for(i=0;i<(delay_min+delay_max)/2;i++)
 		read_delay_inc(module);
 
-	/* Precharge */
-	sdram_dfii_pi0_address_write(0);
-	sdram_dfii_pi0_baddress_write(0);
-	command_p0(DFII_COMMAND_RAS|DFII_COMMAND_WE|DFII_COMMAND_CS);
-	cdelay(15);
+	read_level_precharge();
+
+	return delay_min >= SDRAM_PHY_DELAYS ? -1 : (delay_min+delay_max)/2;
+}
+
+/* Check the taps within 'margin' of a known good read delay all work, and leave it set */
+static int read_level_verify(int module, int delay, int margin)
+{
+	unsigned char prs[SDRAM_PHY_PHASES][DFII_PIX_DATA_BYTES];
+	int i;
+	int working = 1;
+
+	if (delay - margin < 0 || delay + margin >= SDRAM_PHY_DELAYS)
+		return 0;
+
+	read_level_pattern(prs);
+
+	read_delay_rst(module);
+	for(i=0;i<delay+margin;i++) {
+		if(i >= delay-margin && !read_level_working(module, prs))
+			working = 0;
+		read_delay_inc(module);
+	}
+	if(!read_level_working(module, prs))
+		working = 0;
+
+	read_delay_rst(module);
+	for(i=0;i<delay;i++)
+		read_delay_inc(module);
+
+	read_level_precharge();
+
+	return working;
 }
 #endif /* CSR_DDRPHY_BASE */
 
@@ -800,12 +886,13 @@ static void read_leveling(void)
 			read_bitslip_inc(module);
 
 		/* re-do leveling on best read window*/
-		read_level(module);
+		level.bitslip[module] = best_bitslip;
+		level.rdelay[module] = read_level(module);
 		printf("\n");
 	}
 }
 
-int _write_level_cdly_scan = 1;
+static int _write_level_cdly_scan = 1;
 
 static int sdrlevel(void)
 {
@@ -828,6 +915,8 @@ static int sdrlevel(void)
 		/* use only the current cdly */
 		int delays[SDRAM_PHY_MODULES];
 		write_level_scan(delays, 128, 1);
+		for(module=0; module<SDRAM_PHY_MODULES; module++)
+			level.wdelay[module] = delays[module];
 	}
 #endif
 
@@ -838,11 +927,221 @@ static int sdrlevel(void)
 
 	return 1;
 }
+
+/* Apply the settings in 'level' instead of searching for them. The write side is
+ * taken as is, each read delay has to pass a scan of the taps around it. */
+static int sdrlevel_cached(void)
+{
+	int module;
+	int i;
+	sdrsw();
+
+#ifdef SDRAM_PHY_WRITE_LEVELING_CAPABLE
+	if (level.cdly >= 0) {
+		ddrphy_cdly_rst_write(1);
+		for (i = 0; i < level.cdly; ++i) {
+			ddrphy_cdly_inc_write(1);
+			cdelay(10);
+		}
+	}
+	for(module=0; module<SDRAM_PHY_MODULES; module++) {
+		write_delay_rst(module);
+		for(i=0; i<level.wdelay[module]; i++)
+			write_delay_inc(module);
+	}
 #endif
 
+#ifdef SDRAM_PHY_READ_LEVELING_CAPABLE
+	for(module=0; module<SDRAM_PHY_MODULES; module++) {
+		read_bitslip_rst(module);
+		for(i=0; i<level.bitslip[module]; i++)
+			read_bitslip_inc(module);
+		if(!read_level_verify(module, level.rdelay[module], READ_LEVEL_VERIFY_MARGIN)) {
+			printf("Cached read delay m%d: %02d failed\n", module, level.rdelay[module]);
+			return 0;
+		}
+	}
+#endif
+
+	return 1;
+}
+
+/* Ask the host for the settings it has cached for this board, it answers
+ * "ddr3-level cdly=<n> m0=<bitslip>,<read delay>,<write delay> m1=..." or an empty line */
+static int level_request(void)
+{
+	char line[64];
+	char *c;
+	int len = 0;
+	int module;
+
+	/* Drop anything left over from earlier replies, the answer has to start the line */
+	while(uart_read_nonblock())
+		uart_read();
+
+	printf("Info:ddr3-level?\n");
+	for(int i = 0; i < DDR3_LEVEL_TIMEOUT_MS && len < (int)sizeof(line) - 1; ) {
+		if(!uart_read_nonblock()) {
+			msleep(1);
+			i++;
+			continue;
+		}
+		line[len] = uart_read();
+		if(line[len] == '\n' || line[len] == '\r')
+			break;
+		len++;
+	}
+	line[len] = 0;
+
+	if(strncmp(line, "ddr3-level cdly=", 16) != 0)
+		return 0;
+	level.cdly = strtol(line + 16, &c, 10);
+	for(module=0; module<SDRAM_PHY_MODULES; module++) {
+		if(*c++ != ' ' || *c++ != 'm' || strtol(c, &c, 10) != module || *c++ != '=')
+			return 0;
+		level.bitslip[module] = strtol(c, &c, 10);
+		if(*c++ != ',')
+			return 0;
+		level.rdelay[module] = strtol(c, &c, 10);
+		if(*c++ != ',')
+			return 0;
+		level.wdelay[module] = strtol(c, &c, 10);
+	}
+	return *c == 0;
+}
+
+static void level_report(const char *source)
+{
+	int module;
+
+	printf("Info:ddr3-level cdly=%d", level.cdly);
+	for(module=0; module<SDRAM_PHY_MODULES; module++)
+		printf(" m%d=%d,%d,%d", module, level.bitslip[module], level.rdelay[module], level.wdelay[module]);
+	printf(" %s\n", source);
+}
+#endif
+
+/* Address line walk: a write to each power of two offset must only show up there.
+ * Catches address lines stuck high, stuck low or bridged to another. */
+static int memtest_addr_walk(volatile unsigned int *array, unsigned long size)
+{
+	unsigned long offset, test;
+	int errors = 0;
+
+	for(offset = LINE_WORDS; offset < size/4; offset <<= 1)
+		write_line(&array[offset], ONEZERO, ONEZERO);
+	write_line(&array[0], ZEROONE, ZEROONE);
+	flush_caches();
+
+	for(offset = LINE_WORDS; offset < size/4; offset <<= 1)
+		if(array[offset] != ONEZERO)
+			errors++;
+
+	write_line(&array[0], ONEZERO, ONEZERO);
+	for(test = LINE_WORDS; test < size/4; test <<= 1) {
+		write_line(&array[test], ZEROONE, ZEROONE);
+		flush_caches();
+		for(offset = 0; offset < size/4; offset = offset ? offset << 1 : LINE_WORDS)
+			if(offset != test && array[offset] != ONEZERO)
+				errors++;
+		write_line(&array[test], ONEZERO, ONEZERO);
+	}
+	flush_caches();
+
+	return errors;
+}
+
+/* Data line walk: a one and a zero walking across every bit of every word in a line,
+ * so each DQ carries both against its neighbours in every beat of the burst. */
+static int memtest_data_walk(volatile unsigned int *array)
+{
+	int bit, i;
+	int errors = 0;
+
+	for(bit = 0; bit < 32; bit++) {
+		write_line(&array[0], 1u << bit, ~(1u << bit));
+		write_line(&array[LINE_WORDS], ~(1u << bit), 1u << bit);
+		flush_caches();
+		for(i = 0; i < LINE_WORDS; i++) {
+			unsigned int expected = (i & 1) ? ~(1u << bit) : 1u << bit;
+			if(array[i] != expected || array[LINE_WORDS + i] != ~expected)
+				errors++;
+		}
+	}
+
+	return errors;
+}
+
+#define SPARSE_STRIDE_WORDS (4096/4)
+
+/* LFSR data in one line of every 4kB, the line moving along within the 4kB from one
+ * to the next so every column gets some */
+static int memtest_sparse(volatile unsigned int *array, unsigned long size)
+{
+	unsigned long i, n = size/4/SPARSE_STRIDE_WORDS;
+	unsigned int seed;
+	int j, errors = 0;
+
+	seed = 1;
+	for(i = 0; i < n; i++) {
+		volatile unsigned int *line = &array[i*SPARSE_STRIDE_WORDS + (i*LINE_WORDS) % SPARSE_STRIDE_WORDS];
+		unsigned int d[LINE_WORDS];
+		for(j = 0; j < LINE_WORDS; j++)
+			d[j] = seed = lfsr(32, seed);
+		line[0] = d[0];
+		line[1] = d[1];
+		line[2] = d[2];
+		line[3] = d[3];
+	}
+	flush_caches();
+
+	seed = 1;
+	for(i = 0; i < n; i++) {
+		volatile unsigned int *line = &array[i*SPARSE_STRIDE_WORDS + (i*LINE_WORDS) % SPARSE_STRIDE_WORDS];
+		for(j = 0; j < LINE_WORDS; j++) {
+			seed = lfsr(32, seed);
+			if(line[j] != seed)
+				errors++;
+		}
+	}
+
+	return errors;
+}
+
+static int memtest_profile(int profile)
+{
+	volatile unsigned int *array = (unsigned int *) MAIN_RAM_BASE;
+	int errors = 0;
+
+	if(profile & MEMTEST_QUICK)
+		errors += memtest_data_walk(array) + memtest_addr_walk(array, MAIN_RAM_SIZE);
+	if(profile & MEMTEST_SPARSE)
+		errors += memtest_sparse(array, MAIN_RAM_SIZE);
+	if((profile & MEMTEST_FULL) && !memtest((unsigned int *) MAIN_RAM_BASE, MAIN_RAM_SIZE))
+		errors++;
+
+	return errors;
+}
+
 int sdrinit_0(void)
 {
+	unsigned int t_init, t_level, t_memtest;
+	unsigned int t_retry = 0, t_retest = 0;
+	int errors;
+#if defined(SDRAM_PHY_WRITE_LEVELING_CAPABLE) || defined(SDRAM_PHY_READ_LEVELING_CAPABLE)
+	int cached;
+	int module;
+	const char *source;
+
+	/* Before the phase timer, msleep() uses timer0 too */
+	level.cdly = -1;
+	for(module=0; module<SDRAM_PHY_MODULES; module++)
+		level.wdelay[module] = -1;
+	cached = level_request();
+#endif
+
 	printf("Initializing DRAM @0x%08x...\n", MAIN_RAM_BASE);
+	phase_timer_start();
 
 #ifdef CSR_DDRCTRL_BASE
 	ddrctrl_init_done_write(0);
@@ -850,19 +1149,72 @@ int sdrinit_0(void)
 #endif
 	sdrsw();
 	init_sequence();
+	t_init = phase_timer_read();
 #ifdef CSR_DDRPHY_BASE
 #if CSR_DDRPHY_EN_VTC_ADDR
 	ddrphy_en_vtc_write(0);
 #endif
 #if defined(SDRAM_PHY_WRITE_LEVELING_CAPABLE) || defined(SDRAM_PHY_READ_LEVELING_CAPABLE)
-	sdrlevel();
+	if(cached && sdrlevel_cached()) {
+		source = "cached";
+	} else {
+		if(cached) {
+			printf("Cached leveling failed, full scan\n");
+			level.cdly = -1;
+			for(module=0; module<SDRAM_PHY_MODULES; module++)
+				level.wdelay[module] = -1;
+		}
+		sdrlevel();
+		source = "scanned";
+	}
 #endif
 #if CSR_DDRPHY_EN_VTC_ADDR
 	ddrphy_en_vtc_write(1);
 #endif
 #endif
+	t_level = phase_timer_read();
 	sdrhw();
-	if(!memtest((unsigned int *) MAIN_RAM_BASE, MAIN_RAM_SIZE)) {
+	errors = memtest_profile(DDR3_MEMTEST);
+	t_memtest = phase_timer_read();
+#if defined(SDRAM_PHY_WRITE_LEVELING_CAPABLE) || defined(SDRAM_PHY_READ_LEVELING_CAPABLE)
+	/* The cached write side is applied unchecked, only the memtest catches a bad one */
+	if(errors && strcmp(source, "cached") == 0) {
+		printf("Cached leveling failed memtest (errors=%d), full scan\n", errors);
+		level.cdly = -1;
+		for(module=0; module<SDRAM_PHY_MODULES; module++)
+			level.wdelay[module] = -1;
+#ifdef CSR_DDRPHY_BASE
+#if CSR_DDRPHY_EN_VTC_ADDR
+		ddrphy_en_vtc_write(0);
+#endif
+		sdrlevel();
+#if CSR_DDRPHY_EN_VTC_ADDR
+		ddrphy_en_vtc_write(1);
+#endif
+#endif
+		source = "scanned";
+		/* Counted on their own, level= and memtest= stay those of the cached attempt */
+		t_retry = phase_timer_read();
+		sdrhw();
+		errors = memtest_profile(DDR3_MEMTEST);
+		t_retest = phase_timer_read();
+	}
+#endif
+
+	printf("Info:ddr3-memtest %s%s%s errors=%d\n",
+		(DDR3_MEMTEST & MEMTEST_QUICK) ? "quick " : "",
+		(DDR3_MEMTEST & MEMTEST_SPARSE) ? "sparse " : "",
+		(DDR3_MEMTEST & MEMTEST_FULL) ? "full " : "", errors);
+	printf("Info:ddr3-cycles init=%u level=%u memtest=%u",
+		t_init, t_level - t_init, t_memtest - t_level);
+	if(t_retest)
+		printf(" level_retry=%u memtest_retry=%u", t_retry - t_memtest, t_retest - t_retry);
+	printf("\n");
+#if defined(SDRAM_PHY_WRITE_LEVELING_CAPABLE) || defined(SDRAM_PHY_READ_LEVELING_CAPABLE)
+	level_report(source);
+#endif
+
+	if(errors) {
 #ifdef CSR_DDRCTRL_BASE
 		ddrctrl_init_done_write(1);
 		ddrctrl_init_error_write(1);
@@ -53,6 +53,11 @@ from migen.genlib.cdc import MultiReg
 
 import valentyusb
 
+from gatewarecache import GatewareCache, gateware_key, run_toolchain, LOG_SUFFIX
+import brampatch
+import fwinit
+import fwbuild
+
 from rtl.rgb import RGB
 from rtl.analog import AnalogSense
 from litex.soc.cores import spi_flash
@@ -243,6 +248,7 @@ class BaseSoC(SoCCore):
     interrupt_map = {
         "timer0": 2,
         "usb": 3,
+        "asense": 4,
     }
     interrupt_map.update(SoCCore.interrupt_map)
 
@@ -336,11 +342,7 @@ class BaseSoC(SoCCore):
         self.register_mem("spiflash", self.mem_map["spiflash"], self.lxspi.bus, size=16*1024*1024)
 
         # Add GIT repo to the firmware
-        git_rev_cmd = subprocess.Popen(["git", "rev-parse", "--short", "HEAD"],
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE)
-        (git_stdout, _) = git_rev_cmd.communicate()
-        self.add_constant('REPO_GIT_SHA1',git_stdout.decode('ascii').strip('\n'))
+        self.add_constant('REPO_GIT_SHA1', lxbuildenv.repo_git_sha1())
 
 
 
@@ -354,11 +356,22 @@ class BaseSoC(SoCCore):
         builder.add_software_package("fw", src_dir)
 
         builder._prepare_rom_software()
-        builder._generate_includes()
-        builder._generate_rom_software(compile_bios=False)
+
+        # Headers are only rewritten when the SoC changed, so make rebuilds just the touched objects
+        changed = fwbuild.generate_includes(builder)
+        if changed:
+            print(f"Regenerated {', '.join(changed)}")
 
         firmware_file = os.path.join(builder.output_dir, "software", "fw","oc-fw.bin")
-        firmware_data = get_mem_data(firmware_file, self.cpu.endianness)
+        stamp = fwbuild.Stamp(firmware_file)
+        key = fwbuild.firmware_key(self, builder, src_dir)
+        if stamp.matches(key):
+            print("Firmware up to date")
+        else:
+            builder._generate_rom_software(compile_bios=False)
+            stamp.write(key)
+
+        firmware_data = fwinit.load_firmware(firmware_file, self.cpu.endianness)
         self.initialize_rom(firmware_data)
 
         # lock out compiling firmware during build steps
@@ -366,11 +379,7 @@ class BaseSoC(SoCCore):
 
 
 def CreateFirmwareInit(init, output_file):
-    content = ""
-    for d in init:
-        content += "{:08x}\n".format(d)
-    with open(output_file, "w") as o:
-        o.write(content)    
+    fwinit.write_init(init, output_file)
 
 
 # Build --------------------------------------------------------------------------------------------
@@ -393,6 +402,11 @@ def main():
         "--update-firmware", default=False, action='store_true',
         help="compile firmware and update existing gateware"
     )
+    parser.add_argument("--gateware-cache", default=os.environ.get("ORANGECRAB_GATEWARE_CACHE", os.path.join("build", "cache")),
+                        help="directory of cached place and route results, can be shared "
+                             "(default=$ORANGECRAB_GATEWARE_CACHE or build/cache)")
+    parser.add_argument("--no-gateware-cache", default=False, action='store_true',
+                        help="always run yosys/nextpnr")
     args = parser.parse_args()
 
     soc = BaseSoC(toolchain=args.toolchain, sys_clk_freq=int(float(args.sys_clk_freq)),**argdict(args))
@@ -406,7 +420,7 @@ def main():
         
     # Check if we have the correct files
     firmware_file = os.path.join(builder.output_dir, "software", "fw", "oc-fw.bin")
-    firmware_data = get_mem_data(firmware_file, soc.cpu.endianness)
+    firmware_data = fwinit.load_firmware(firmware_file, soc.cpu.endianness)
     firmware_init = os.path.join(builder.output_dir, "software", "fw", "oc-fw.init")
     CreateFirmwareInit(firmware_data, firmware_init)
     
@@ -419,18 +433,31 @@ def main():
         os.makedirs(os.path.join(builder.output_dir,'gateware'), exist_ok=True)
         os.makedirs(os.path.join(builder.output_dir,'software'), exist_ok=True)
 
-        os.system(f"ecpbram  --generate {rand_rom} --seed {0} --width {32} --depth {soc.integrated_rom_size}")
+        brampatch.generate(rand_rom, soc.integrated_rom_size, width=32, seed=0)
 
         # patch random file into BRAM
-        data = []
-        with open(rand_rom, 'r') as inp:
-            for d in inp.readlines():
-                data += [int(d, 16)]
-        soc.initialize_rom(data)
+        soc.initialize_rom(brampatch.read_hex(rand_rom).tolist())
 
         # Build gateware
         builder_kargs = trellis_argdict(args) if args.toolchain == "trellis" else {}
-        vns = builder.build(**builder_kargs)
+        if args.no_gateware_cache or args.toolchain != "trellis":
+            vns = builder.build(**builder_kargs)
+        else:
+            # Write out the Verilog and build script, and only run them when nothing matches
+            vns = builder.build(run=False, **builder_kargs)
+            build_name = soc.platform.name
+            cache = GatewareCache(args.gateware_cache)
+            key = gateware_key(builder.gateware_dir)
+            if cache.fetch(key, builder.gateware_dir, build_name):
+                print(f"Gateware cache hit {key[:16]}, skipping yosys/nextpnr")
+                # Timing and utilization of the cached build, for OrangeCrab-matrix.py and the log
+                log = os.path.join(builder.gateware_dir, build_name + LOG_SUFFIX)
+                if os.path.exists(log):
+                    with open(log, "r", errors="replace") as f:
+                        print(f.read(), end="")
+            else:
+                run_toolchain(builder.gateware_dir, build_name)
+                cache.store(key, builder.gateware_dir, build_name)
         soc.do_exit(vns)   
     
 
@@ -438,7 +465,8 @@ def main():
     output_config = os.path.join(builder.output_dir, "gateware", f"{soc.platform.name}_patched.config")
 
     # Insert Firmware into Gateware
-    os.system(f"ecpbram  --input {input_config} --output {output_config} --from {rand_rom} --to {firmware_init}")
+    replaced, patterns = brampatch.patch_config(input_config, output_config, rand_rom, firmware_init)
+    print(f"Firmware patched into {replaced}/{patterns} BRAM bit slices")
 
 
     # create compressed config (ECP5 specific)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+# This file is Copyright (c) Greg Davill <greg.davill@gmail.com>
+# License: BSD
+
+# Build every combination of device, board revision and SDRAM part at once.
+#
+# Each variant runs OrangeCrab-bitstream.py in its own process with its own
+# output directory (build/<device>-r<revision>-<sdram>), as many at a time as
+# there are cores. The first variant that fails stops the rest. At the end
+# every variant's nextpnr timing and utilization is summarized, and written to
+# build/matrix.json.
+#
+#   python3 OrangeCrab-matrix.py --device 25F 85F --sdram-device MT41K64M16 MT41K256M16
+#
+# Any other arguments are passed on to OrangeCrab-bitstream.py.
+
+import os
+import re
+import sys
+import json
+import shutil
+import argparse
+import itertools
+import threading
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from time import monotonic
+
+
+hw_dir = os.path.dirname(os.path.abspath(__file__))
+
+# "Info: Max frequency for clock '$glbnet$crg_clkout': 62.45 MHz (PASS at 48.00 MHz)"
+FMAX = re.compile(r"Max frequency for clock\s+'([^']+)':\s+([\d.]+) MHz \((PASS|FAIL) at ([\d.]+) MHz\)")
+# "Info:          TRELLIS_SLICE:  5432/12144    44%"
+UTIL = re.compile(r"Info:\s+(\w+):\s+(\d+)/\s*(\d+)\s+(\d+)%")
+
+# The board the test station flashes, its bitstream goes by device alone in prebuilt/
+# (sw/octest/flow.py loads orangecrab-test-85F.bit)
+STATION_REVISION = "0.2"
+STATION_SDRAM = "MT41K64M16"
+
+
+class Variant:
+    def __init__(self, device, revision, sdram_device):
+        self.device = device
+        self.revision = revision
+        self.sdram_device = sdram_device
+
+        self.name = f"{device}-r{revision}-{sdram_device}"
+        self.output_dir = os.path.join("build", self.name)
+
+        self.result = None
+        self.duration = None
+        self.fmax = {}
+        self.utilization = {}
+
+    def command(self, extra):
+        return [sys.executable, "OrangeCrab-bitstream.py",
+                "--device", self.device, "--revision", self.revision, "--sdram-device", self.sdram_device,
+                "--output-dir", self.output_dir] + extra
+
+    def prebuilt_name(self):
+        if (self.revision, self.sdram_device) == (STATION_REVISION, STATION_SDRAM):
+            return f"orangecrab-test-{self.device}.bit"
+        return f"orangecrab-test-{self.name}.bit"
+
+    def parse_log(self, text):
+        # nextpnr reports after placement and again after routing, the last one counts
+        for clock, fmax, verdict, target in FMAX.findall(text):
+            self.fmax[clock] = dict(fmax=float(fmax), target=float(target), result=verdict)
+        for name, used, available, percent in UTIL.findall(text):
+            self.utilization[name] = dict(used=int(used), available=int(available))
+
+    def report(self):
+        return dict(name=self.name, device=self.device, revision=self.revision, sdram_device=self.sdram_device,
+                    result=self.result, duration=self.duration, fmax=self.fmax, utilization=self.utilization)
+
+
+class Matrix:
+    def __init__(self, variants, jobs, extra):
+        self.variants = variants
+        self.jobs = jobs
+        self.extra = extra
+
+        self._running = {}
+        self._lock = threading.Lock()
+        self._stopping = False
+
+    def _build(self, v):
+        log = os.path.join(hw_dir, v.output_dir, "build.log")
+        os.makedirs(os.path.dirname(log), exist_ok=True)
+
+        start = monotonic()
+        with open(log, "w") as f:
+            with self._lock:
+                if self._stopping:
+                    v.result = "SKIP"
+                    return v
+                p = subprocess.Popen(v.command(self.extra), cwd=hw_dir,
+                                     stdout=f, stderr=subprocess.STDOUT)
+                self._running[v.name] = p
+            p.wait()
+            with self._lock:
+                del self._running[v.name]
+        v.duration = monotonic() - start
+
+        with open(log, "r", errors="replace") as f:
+            v.parse_log(f.read())
+
+        if p.returncode != 0:
+            v.result = "SKIP" if self._stopping else "FAIL"
+            raise RuntimeError(f"{v.name} failed, see {log}")
+        v.result = "PASS"
+        return v
+
+    def stop(self):
+        with self._lock:
+            self._stopping = True
+            for p in self._running.values():
+                p.terminate()
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            futures = [pool.submit(self._build, v) for v in self.variants]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            failed = [f for f in done if f.exception() is not None]
+            if failed:
+                # Fail fast, the other variants can't be released without this one
+                self.stop()
+                for f in futures:
+                    f.cancel()
+                print(failed[0].exception())
+            wait(futures)
+        for v in self.variants:
+            if v.result is None:
+                v.result = "SKIP"
+        return not failed
+
+
+def summary(variants):
+    lines = [f"  {'variant':30s}{'result':>7s}{'time':>8s}{'fmax':>10s}{'slices':>8s}{'bram':>6s}"]
+    for v in variants:
+        fmax = min((c["fmax"] for c in v.fmax.values()), default=None)
+        slices = v.utilization.get("TRELLIS_SLICE")
+        bram = v.utilization.get("DP16KD")
+        percent = lambda u: f"{u['used'] / u['available']:.0%}" if u else "-"
+        lines.append(f"  {v.name:30s}{v.result:>7s}"
+                     f"{f'{v.duration:.0f}s' if v.duration is not None else '-':>8s}"
+                     f"{f'{fmax:.1f}MHz' if fmax is not None else '-':>10s}"
+                     f"{percent(slices):>8s}{percent(bram):>6s}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build OrangeCrab test bitstreams for several variants in parallel",
+                                     epilog="Other arguments are passed on to OrangeCrab-bitstream.py")
+    parser.add_argument("--device", nargs="+", default=["25F", "85F"],
+                        help="ECP5 devices (default=25F 85F)")
+    parser.add_argument("--revision", nargs="+", default=[STATION_REVISION],
+                        help=f"board revisions (default={STATION_REVISION})")
+    parser.add_argument("--sdram-device", nargs="+", default=[STATION_SDRAM],
+                        help=f"SDRAM parts (default={STATION_SDRAM})")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="variants built at once (default=number of cores)")
+    parser.add_argument("--prebuilt", default=None,
+                        help="copy each bitstream to <dir> when all variants pass, as orangecrab-test-<device>.bit "
+                             f"for r{STATION_REVISION} with {STATION_SDRAM} (what the test flow loads), "
+                             "orangecrab-test-<variant>.bit for the others")
+    args, extra = parser.parse_known_args()
+
+    variants = [Variant(d, r, s) for d, r, s in itertools.product(args.device, args.revision, args.sdram_device)]
+
+    start = monotonic()
+    ok = Matrix(variants, max(1, args.jobs), extra).run()
+    total = monotonic() - start
+
+    print(f"\n-- {len(variants)} variants in {total:.0f}s")
+    for l in summary(variants):
+        print(l)
+
+    with open(os.path.join(hw_dir, "build", "matrix.json"), "w") as f:
+        json.dump(dict(duration=total, variants=[v.report() for v in variants]), f, indent=1)
+
+    if ok and args.prebuilt is not None:
+        os.makedirs(args.prebuilt, exist_ok=True)
+        for v in variants:
+            shutil.copyfile(os.path.join(hw_dir, v.output_dir, "gateware", "orangecrab.bit"),
+                            os.path.join(args.prebuilt, v.prebuilt_name()))
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
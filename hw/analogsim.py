@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+
+# This file is Copyright (c) Greg Davill <greg.davill@gmail.com>
+# License: BSD
+
+# Simulation of rtl/analog.py's AnalogSense against a model of its RC circuit.
+#
+# RcModel produces the comparator output for any input voltage, one bit per
+# DDR half-cycle: 1 while the sense capacitor, charging once ctrl goes high,
+# is still below the input (seen through its 1/2 divider). While ctrl is low
+# the capacitor discharges through the same resistor.
+#
+# simulate() runs the real AnalogSense in the migen simulator, with RcModel
+# driving its sense input off the ctrl pin, one conversion after another.
+# That takes half a minute per conversion at the default timings, so the same
+# conversions are also computed with arrays: counts() for conversions from a
+# fully discharged capacitor, convert() for a sequence of them where each one
+# starts with what the last one left on the capacitor, and early termination
+# can cut the charge phase short. --check makes sure the RTL and convert()
+# agree, after any change to either.
+#
+# --study runs the firmware's ADC test (DAC sweep, rails, battery reads)
+# through convert() for a few Timing settings and judges each the way the host
+# does, to trade conversion time against accuracy.
+#
+#   python3 analogsim.py --check 0.5 1.65 3.3     # migen vs convert(), exact
+#   python3 analogsim.py --check 0 0.5 3.3 --timing 0x100,0x4000,0x800,16
+#   python3 analogsim.py --sweep 10000            # fit K/offset over a sweep
+#   python3 analogsim.py --sweep 10000 --noise 0.005 --k 38000
+#   python3 analogsim.py --study --noise 0.005
+#   python3 analogsim.py --study --stagger -1     # ADC_SWEEP_BATCH=0
+
+import os
+import sys
+import argparse
+
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sw"))
+from octest.adc import AdcSweep, Vchg, Vs, K, OFFSET, K_TOLERANCE, CHANNELS, DAC_VREF, DAC_FULL_SCALE
+
+
+CLOCK = 48e6
+
+# ctrl register, sense input register, sense_value register
+LATENCY = 3
+
+# Cycles the testbench spends in IDLE between conversions, reading the result
+# and starting the next one
+TB_IDLE = 2
+
+
+class Timing:
+    """AnalogSense phase durations and mode, as written to its CSRs. The defaults are the reset values."""
+    def __init__(self, setup=0x8000, charge=0x8000, discharge=0x20000, settle=None):
+        self.setup = setup
+        self.charge = charge
+        self.discharge = discharge
+        self.early = settle is not None
+        self.settle = 64 if settle is None else settle
+
+    @classmethod
+    def parse(cls, text):
+        """"setup,charge,discharge[,settle]", giving settle turns early termination on."""
+        return cls(*[int(v, 0) for v in text.split(",")])
+
+    def low_cycles(self, idle):
+        """Cycles ctrl is low between two conversions, with `idle` cycles in IDLE."""
+        return self.discharge + self.setup + idle + 2
+
+    def __str__(self):
+        s = f"{self.setup:#x},{self.charge:#x},{self.discharge:#x}"
+        return s + (f",{self.settle}" if self.early else "")
+
+
+class RcModel:
+    """Sense comparator output while the capacitor charges.
+
+    The node follows Vs - (Vs - v0) * exp(-(h + offset) / k), h in half-cycles of the
+    48 MHz clock since ctrl went high and v0 what was left on the capacitor, and
+    decays as v * exp(-h / k) while ctrl is low. noise is the rms comparator input
+    noise in volts while charging, it dithers the edge like on a board.
+    """
+    def __init__(self, k=K, offset=OFFSET, vs=Vs, noise=0.0, seed=0):
+        self.k = k
+        self.offset = offset
+        self.vs = vs
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+
+    def node(self, h, v0=0.0):
+        return self.vs - (self.vs - v0) * np.exp(-(np.asarray(h, dtype=np.float64) + self.offset) / self.k)
+
+    def decay(self, v, h):
+        return v * np.exp(-np.asarray(h, dtype=np.float64) / self.k)
+
+    def sense_bits(self, vin, length, v0=0.0):
+        """[voltage, half-cycle] comparator bits for the first `length` half-cycles of charge."""
+        vin = np.atleast_1d(np.asarray(vin, dtype=np.float64))
+        diff = vin[:, None] / 2 - self.node(np.arange(length), v0)[None, :]
+        if self.noise:
+            diff += self.rng.normal(0, self.noise, diff.shape)
+        return diff > 0
+
+    def crossing(self, vin, v0=0.0):
+        """Half-cycles of charge before the node reaches each input voltage, without noise."""
+        vin = np.atleast_1d(np.asarray(vin, dtype=np.float64))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            h = -self.k * np.log1p(-np.minimum(vin / 2 - v0, self.vs - v0) / (self.vs - v0)) - self.offset
+        h = np.ceil(np.nan_to_num(h, nan=0.0, posinf=np.inf))
+        # Round the same way as the comparator bits from node() do
+        at = np.isfinite(h) & (h > 0)
+        h[at] += vin[at] / 2 - self.node(h[at], v0) > 0
+        at &= h > 0
+        h[at] -= vin[at] / 2 - self.node(h[at] - 1, v0) <= 0
+        return h
+
+
+def counts(model, vin, timing=Timing(), batch=256):
+    """AnalogSense results for an array of input voltages, each from a discharged capacitor."""
+    vin = np.atleast_1d(np.asarray(vin, dtype=np.float64))
+    # The first LATENCY cycles of the window still see the discharged node
+    window = 2 * max(0, timing.charge - LATENCY)
+    before = 2 * LATENCY * (vin > 0)
+
+    if not model.noise:
+        return (before + np.clip(model.crossing(vin), 0, window)).astype(np.int64)
+
+    out = np.empty(len(vin), dtype=np.int64)
+    for i in range(0, len(vin), batch):
+        out[i:i + batch] = model.sense_bits(vin[i:i + batch], window).sum(axis=1)
+    return before + out
+
+
+def _charge(model, v, v0, before, quiet, timing):
+    """(cycles of charge window, result) of one conversion.
+
+    before are the comparator bits counted at the start of the window, while the
+    capacitor was still discharging, and quiet the quiet counter going into it.
+    """
+    window = 2 * max(0, timing.charge - LATENCY)
+    if timing.early and (timing.settle == 0 or quiet >= timing.settle):
+        return 0, 0
+
+    if not model.noise:
+        h = float(model.crossing(v, v0)[0])
+        result = int(before.sum() + np.clip(h, 0, window))
+        if not timing.early or h >= window:
+            return timing.charge, result
+        # First cycle of the window from which the comparator reads low for good
+        ones = np.flatnonzero(before.reshape(-1, 2).any(axis=1))
+        if h > 0:
+            first = LATENCY + int(np.ceil(h / 2))
+        else:
+            first = int(ones[-1]) + 1 if len(ones) else -quiet
+        return max(0, min(first + timing.settle, timing.charge)), result
+
+    bits = model.sense_bits(v, window, v0)[0]
+    value = np.concatenate([before, bits]).reshape(-1, 2).sum(axis=1)[:timing.charge]
+    if timing.early:
+        # The quiet counter at each cycle, from the last non zero value before it
+        index = np.arange(len(value))
+        last = np.maximum.accumulate(np.where(value != 0, index, -1 - quiet))
+        q = np.concatenate([[quiet], index - last])[:len(value)]
+        done = np.flatnonzero(q >= timing.settle)
+        if len(done):
+            return int(done[0]), int(value[:done[0]].sum())
+    return timing.charge, int(value.sum())
+
+
+def convert(model, vin, timing=Timing(), idle=TB_IDLE):
+    """Conversions one after another as the RTL does them. Returns (results, cycles each took).
+
+    Each conversion starts with what the previous one left on the capacitor after
+    the ctrl low time, which counts() leaves out. `idle` is the number of cycles
+    AnalogSense sits in IDLE between conversions, 1 within a scan. Either can also
+    be a sequence, one per conversion, for a test that changes them on the way.
+    """
+    vin = np.atleast_1d(np.asarray(vin, dtype=np.float64))
+    results = np.zeros(len(vin), dtype=np.int64)
+    cycles = np.zeros(len(vin), dtype=np.int64)
+    timings = [timing] * len(vin) if isinstance(timing, Timing) else list(timing)
+    idles = [idle] * len(vin) if np.isscalar(idle) else list(idle)
+    v_end, v_last = 0.0, 0.0
+    discharge = timings[0].discharge
+    for i, v in enumerate(vin):
+        timing, idle = timings[i], idles[i]
+        # ctrl stays low through the last one's DISCHARGE and this one's SETUP
+        low = discharge + timing.setup + idle + 2
+        discharge = timing.discharge
+        # The mux stays on the last input through DISCHARGE, goes to GND in IDLE and to
+        # the next input for the last `new` cycles
+        new = timing.setup + 2
+        ground = idle - 1
+        # The window starts with what the comparator saw while discharging, the quiet
+        # counter with the zeros before that. The capacitor only discharges, so the
+        # comparator output only ever rises while on the same input.
+        before = (v / 2 > model.decay(v_end, np.arange(2 * (low - LATENCY), 2 * low))).astype(np.int64)
+        if v / 2 > model.decay(v_end, 2 * (low - LATENCY) - 1):
+            quiet = 0
+        elif v_last / 2 > model.decay(v_end, 2 * (low - new - ground) - 1):
+            quiet = new - LATENCY + ground
+        else:
+            quiet = 1 << 24
+        v0 = float(model.decay(v_end, 2 * low))
+
+        end, results[i] = _charge(model, v, v0, before, quiet, timing)
+        cycles[i] = timing.setup + end + timing.discharge + 4 + idle
+        v_end, v_last = float(model.node(2 * (end + 1), v0)), v
+    return results, cycles
+
+
+# Cycle accurate simulation ------------------------------------------------------------------------
+
+def _testbench(model, timing, inputs):
+    """AnalogSense with RcModel on its sense input, inputs[n] being the voltage on mux channel n."""
+    from migen import Record, passive
+    from rtl.analog import AnalogSense
+
+    pads = Record([("sense_p", 1), ("mux", 4), ("enable", 1), ("ctrl", 1)])
+    dut = AnalogSense(pads, ddr_input=False)
+    # Normally the CSR bank brings in the logic behind the CSR fields
+    for csr in dut.get_csrs():
+        dut.comb += csr._fragment.comb
+
+    @passive
+    def rc():
+        # h counts half-cycles since ctrl last changed
+        h, v, v0, bits = 0, 0.0, 0.0, None
+        while True:
+            high = yield pads.ctrl
+            vin = inputs[(yield pads.mux)]
+            if high and bits is None:
+                v0, h = float(model.decay(v, h)), 0
+                bits = model.sense_bits(vin, 2 * timing.charge + 2, v0)[0]
+            elif not high and bits is not None:
+                v, h, bits = float(model.node(h, v0)), 0, None
+            if bits is not None:
+                pair = bits[h:h + 2]
+            else:
+                pair = vin / 2 > model.decay(v, [h, h + 1])
+            yield dut.sense_iob.eq(int(pair[0]) | int(pair[1]) << 1)
+            h += 2
+            yield
+
+    def configure():
+        yield from dut._setup.write(timing.setup)
+        yield from dut._charge.write(timing.charge)
+        yield from dut._discharge.write(timing.discharge)
+        yield from dut._mode.write(int(timing.early) | timing.settle << 16)
+        # convert() starts from a capacitor that has been discharged for a long time
+        for _ in range(timing.settle):
+            yield
+
+    return dut, rc(), configure()
+
+
+def simulate(vin, model, timing=Timing(), idle=TB_IDLE, chans=(1, 2), vcd_name=None):
+    """Convert each voltage with the AnalogSense RTL in the migen simulator. Returns the results.
+
+    The conversions take turns on chans, so each voltage is in place before the mux gets to it.
+    """
+    from migen import run_simulation
+
+    inputs = [0.0] * 16
+    dut, rc, configure = _testbench(model, timing, inputs)
+    results = []
+
+    def cpu():
+        yield from configure
+        for i, v in enumerate(vin):
+            chan = chans[i % len(chans)]
+            inputs[chan] = v
+            yield from dut._control.write(1 | chan << 8)
+            yield
+            while not (yield dut._status.fields.idle):
+                yield
+            results.append((yield dut._result.status))
+            for _ in range(idle - TB_IDLE):
+                yield
+
+    run_simulation(dut, [cpu(), rc], vcd_name=vcd_name)
+    return np.array(results, dtype=np.int64)
+
+
+def simulate_scan(inputs, mask, model, timing=Timing(), vcd_name=None):
+    """Scan the channels in mask in the migen simulator.
+
+    The CPU only reads the FIFO once the done interrupt fires. Returns the (channel, result)s.
+    """
+    from migen import run_simulation
+
+    dut, rc, configure = _testbench(model, timing, inputs)
+    results = []
+
+    def cpu():
+        yield from configure
+        yield from dut.ev.enable.write(1)
+        yield from dut._scan.write(mask | 1 << 16)
+        yield
+        while not (yield dut.ev.irq):
+            yield
+        while (yield dut._scan_status.fields.readable):
+            results.append(((yield dut._scan_result.fields.chan), (yield dut._scan_result.fields.result)))
+            yield from dut._scan_pop.write(1)
+            yield
+
+    run_simulation(dut, [cpu(), rc], vcd_name=vcd_name)
+    return results
+
+
+def check(vin, model, timing, idle):
+    t = perf_counter()
+    sim = simulate(vin, model, timing, idle)
+    elapsed = perf_counter() - t
+    ref, _ = convert(model, vin, timing, idle)
+    for v, a, b in zip(vin, sim, ref):
+        print(f"  {v:5.3f}V  rtl {a:6d}  model {b:6d}  {'ok' if a == b else 'MISMATCH'}")
+    print(f"{len(vin)} conversions simulated in {elapsed:.1f}s")
+    return bool(np.all(sim == ref))
+
+
+def check_scan(vin, model, timing):
+    """Scan channels 1.. with these voltages on them, plus GND, and compare with convert()."""
+    inputs = [0.0] + list(vin) + [0.0] * (15 - len(vin))
+    mask = (1 << (len(vin) + 1)) - 1
+    t = perf_counter()
+    sim = simulate_scan(inputs, mask, model, timing)
+    elapsed = perf_counter() - t
+    ref, _ = convert(model, inputs[:len(vin) + 1], timing, idle=1)
+    ok = [c for c, _ in sim] == list(range(len(ref)))
+    for (c, a), b in zip(sim, ref):
+        print(f"  CH{c:<2d} {inputs[c]:5.3f}V  rtl {a:6d}  model {b:6d}  {'ok' if a == b else 'MISMATCH'}")
+        ok = ok and a == b
+    print(f"{len(sim)} channels scanned in {elapsed:.1f}s")
+    return ok and len(sim) == len(ref)
+
+
+# Sweep and fit ------------------------------------------------------------------------------------
+
+def sweep(n, model, timing):
+    """Convert n DAC codes across the range and fit K and offset like the host does."""
+    codes = np.linspace(0, DAC_FULL_SCALE - 1, n).astype(np.int64)
+    vin = codes * (DAC_VREF / DAC_FULL_SCALE)
+
+    t = perf_counter()
+    adc = counts(model, vin, timing)
+    elapsed = perf_counter() - t
+
+    s = AdcSweep(n)
+    for i, (code, count) in enumerate(zip(codes, adc)):
+        s.append(i % CHANNELS, code, count)
+    k, offset = s.fit()
+
+    # Worst error of the host conversion, with the fitted and with the default constants
+    m = (codes > 0) & (vin / 2 < 0.95 * Vs)
+    err = lambda k, o: np.max(np.abs(Vchg(adc[m].astype(np.float64), k, o) * 2 - vin[m]))
+    print(f"{n} conversions in {elapsed * 1e3:.1f}ms")
+    print(f"  model   K = {model.k:.0f}, offset = {model.offset:.0f}")
+    print(f"  fit     K = {k:.0f}, offset = {offset:.0f}, worst error {err(k, offset) * 1e3:.1f}mV")
+    print(f"  default K = {K:.0f}, offset = {OFFSET:.0f}, worst error {err(K, OFFSET) * 1e3:.1f}mV")
+    return k, offset
+
+
+# Firmware ADC test --------------------------------------------------------------------------------
+
+# Rail voltages at the sense input (VBAT is a charged cell through its own 1/2 divider)
+RAILS = {'GND': 0.0, 'VREF': 3.3, '3V3': 3.3, '1V35': 1.35, '2V5': 2.5, '1V1': 1.1, 'VBAT': 2.1}
+BATT_READS = 60
+
+# ADC_SWEEP_STEPS and ADC_SWEEP_STAGGER in fw/include/asense.h
+SWEEP_STEPS = 32
+SWEEP_STAGGER = 5
+
+# Settings compared by --study for the DAC sweep: the reset values, then progressively
+# shorter phases. Most of the time goes into discharging, whatever is left on the
+# capacitor biases the next conversion, and within a staggered scan the next channel is
+# usually far from the last one. The rails and the battery are converted with the reset
+# values after it, as fw/main.c does. 0x400,0x8000,0x18000,64 is what it uses for the sweep.
+STUDY = ["0x8000,0x8000,0x20000", "0x8000,0x8000,0x20000,64", "0x400,0x8000,0x20000,64",
+         "0x400,0x8000,0x18000,64", "0x400,0x8000,0x14000,64", "0x400,0x8000,0xc000,64",
+         "0x1000,0x8000,0x8000,64", "0x400,0x6000,0x4000,16"]
+
+
+def firmware_sequence(stagger=SWEEP_STAGGER, idle=TB_IDLE):
+    """Input voltages in the order fw/main.c converts them, the IDLE cycles before each, and the
+    sweep's (channel, code)s.
+
+    Each step of the sweep scans the six channels back to back, channel i at code
+    (step + i * stagger) % SWEEP_STEPS; stagger None is the one channel at a time ramp
+    of ADC_SWEEP_BATCH=0. Single conversions and the first of each scan get `idle`.
+    """
+    if stagger is None:
+        sweep = [(ch, code) for ch in range(CHANNELS) for code in range(0, 0x0fff, 0x80)]
+        idles = [idle] * len(sweep)
+    else:
+        sweep = [(ch, (step + ch * stagger) % SWEEP_STEPS * 0x80)
+                 for step in range(SWEEP_STEPS) for ch in range(CHANNELS)]
+        idles = [idle if ch == 0 else 1 for ch, _ in sweep]
+    vin = [code * (DAC_VREF / DAC_FULL_SCALE) for _, code in sweep]
+    vin += list(RAILS.values()) + [RAILS['VBAT']] * BATT_READS
+    idles += [idle] + [1] * (len(RAILS) - 1) + [idle] * BATT_READS
+    return np.array(vin), idles, sweep
+
+
+def judge(results, sweep):
+    """The host's verdict on one ADC test: (worst channel error, worst rail error, pass)."""
+    s = AdcSweep(len(sweep))
+    for (ch, code), count in zip(sweep, results):
+        s.append(ch, code, count)
+    k, offset = s.fit()
+    with np.errstate(invalid="ignore"):
+        channel = float(np.nanmax(s.analyse(k, offset)["mean_error"]))
+
+    rails = dict(zip(RAILS, results[len(sweep):]))
+    rail = max(abs(Vchg(rails[r], k, offset) * 2 - v) / v for r, v in RAILS.items() if v and r != 'VBAT')
+    return channel, rail, abs(k - K) / K <= K_TOLERANCE and channel <= 0.2 and rail <= 0.25
+
+
+def study(model, timings, idle, stagger=SWEEP_STAGGER):
+    vin, idles, sweep = firmware_sequence(stagger, idle)
+    print(f"{'setup,charge,discharge,settle':32s}{'sweep':>8s}{'ADC time':>10s}{'channel':>9s}{'rail':>8s}")
+    for timing in timings:
+        # The sweep with the timing under study, the rest with the reset values
+        per_conversion = [timing] * len(sweep) + [Timing()] * (len(vin) - len(sweep))
+        results, cycles = convert(model, vin, per_conversion, idles)
+        channel, rail, ok = judge(results, sweep)
+        print(f"{str(timing):32s}{cycles[:len(sweep)].sum() / CLOCK * 1e3:6.0f}ms{cycles.sum() / CLOCK * 1e3:8.0f}ms"
+              f"{channel:9.1%}{rail:8.1%}  {'PASS' if ok else 'FAIL'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate AnalogSense against an RC circuit model")
+    parser.add_argument("--check", nargs="+", type=float, metavar="V",
+                        help="run these input voltages through the RTL and compare with the array model")
+    parser.add_argument("--sweep", type=int, metavar="N",
+                        help="convert N voltages with the array model and fit K and offset")
+    parser.add_argument("--scan", nargs="+", type=float, metavar="V",
+                        help="scan GND and channels 1.. with these voltages in the RTL and compare with the array model")
+    parser.add_argument("--study", action="store_true",
+                        help="run the firmware ADC test with several timings, time against accuracy")
+    parser.add_argument("--timing", action="append", type=Timing.parse, metavar="S,C,D[,SETTLE]",
+                        help="setup, charge and discharge cycles, and settle cycles to terminate early "
+                             "(default=the reset values, or a built in list for --study)")
+    parser.add_argument("--idle", type=int, default=TB_IDLE,
+                        help=f"cycles in IDLE between conversions (default={TB_IDLE}, the least there can be)")
+    parser.add_argument("--stagger", type=int, default=SWEEP_STAGGER,
+                        help=f"steps between the sweep codes of neighbouring channels for --study, "
+                             f"-1 for the one channel at a time ramp (default={SWEEP_STAGGER})")
+    parser.add_argument("--k", type=float, default=K, help=f"RC constant in half-cycles (default={K})")
+    parser.add_argument("--offset", type=float, default=OFFSET, help=f"charge offset in half-cycles (default={OFFSET})")
+    parser.add_argument("--noise", type=float, default=0.0, help="rms comparator noise in volts (default=0)")
+    parser.add_argument("--seed", type=int, default=0, help="noise seed (default=0)")
+    args = parser.parse_args()
+
+    model = RcModel(args.k, args.offset, noise=args.noise, seed=args.seed)
+    if args.check is None and args.scan is None and args.sweep is None and not args.study:
+        parser.error("one of --check, --scan, --sweep or --study is required")
+    if (args.check is not None or args.scan is not None) and args.noise:
+        parser.error("--check needs a noise free model, the two would draw different noise")
+    if args.idle < TB_IDLE:
+        parser.error(f"--idle must be at least {TB_IDLE}")
+
+    timing = args.timing[0] if args.timing else Timing()
+    if args.check is not None and not check(args.check, model, timing, args.idle):
+        sys.exit(1)
+    if args.scan is not None and not check_scan(args.scan, model, timing):
+        sys.exit(1)
+    if args.sweep is not None:
+        sweep(args.sweep, model, timing)
+    if args.study:
+        study(model, args.timing or [Timing.parse(t) for t in STUDY], args.idle,
+              None if args.stagger < 0 else args.stagger)
+
+
+if __name__ == "__main__":
+    main()
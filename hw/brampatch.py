@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+# This file is Copyright (c) Greg Davill <greg.davill@gmail.com>
+# License: BSD
+
+# Swap the firmware into the block RAMs of a placed and routed ECP5 design,
+# the job ecpbram does, without leaving Python.
+#
+# The gateware is built with a ROM full of random words ("from"). Taken 256
+# words at a time, every bit position of those words is a random 256 bit
+# pattern, which shows up as a column somewhere in the init data of one of the
+# DP16KD blocks in the textual .config. The column is found by looking the
+# candidate columns of every block up in a table of those patterns, and
+# overwritten with the same bit slice of the firmware ("to").
+#
+# The .config is parsed once, only the .bram_init blocks are touched, and the
+# result is written in a single pass. To compare against ecpbram:
+#   python3 brampatch.py --input x.config --output y.config --from rand.data --to oc-fw.init --verify
+
+import os
+import sys
+import random
+import argparse
+import subprocess
+import tempfile
+
+import numpy as np
+
+
+PATTERN_WORDS = 256     # words per bit slice pattern
+BRAM_WORDS = 2048       # 9 bit words in one .bram_init block
+BRAM_BITS = BRAM_WORDS * 9
+
+
+def generate(filename, depth, width=32, seed=0):
+    """Random init data for the ROM, like `ecpbram --generate`."""
+    rng = random.Random(seed)
+    digits = (width + 3) // 4
+    with open(filename, "w") as f:
+        f.write("".join(f"{rng.getrandbits(width):0{digits}x}\n" for _ in range(depth)))
+
+
+def read_hex(filename):
+    with open(filename, "r") as f:
+        return np.array([int(l, 16) for l in f.read().split()], dtype=np.uint64)
+
+
+def _bit_slices(words, width, depth):
+    """(bit slices, 256 bits each) of the first `depth` words, packed into bytes."""
+    words = np.pad(words[:depth], (0, max(0, depth - len(words))))
+    n = depth // PATTERN_WORDS * PATTERN_WORDS
+    bits = (words[:n, None] >> np.arange(width, dtype=np.uint64)) & 1     # [word, bit]
+    slices = bits.reshape(-1, PATTERN_WORDS, width).transpose(0, 2, 1)     # [chunk, bit, word]
+    return np.packbits(slices.reshape(-1, PATTERN_WORDS).astype(np.uint8), axis=1)
+
+
+def _candidate_columns():
+    """Flat bit indices of every 256 word run of every bit column a DP16KD can hold, in any width."""
+    columns = []
+    # x9, x18, x36: each word takes 9, 18 or 36 consecutive bits, parity included
+    for stride in (9, 18, 36):
+        for c in range(stride):
+            columns.append(c + stride * np.arange(BRAM_BITS // stride))
+    # x1, x2, x4: words are packed into the low 8 bits of the 9 bit words
+    for width in (1, 2, 4):
+        a = np.arange(BRAM_WORDS * 8 // width)
+        for k in range(width):
+            columns.append((a * width) // 8 * 9 + (a * width) % 8 + k)
+    return np.concatenate([c.reshape(-1, PATTERN_WORDS) for c in columns])
+
+CANDIDATES = _candidate_columns()
+
+
+class BramConfig:
+    """Textual ECP5 config with its .bram_init blocks parsed into arrays of 9 bit words."""
+    def __init__(self, text):
+        self.segments = []  # text between blocks, and (index, values, tokens per line) for blocks
+        pos = 0
+        while True:
+            start = text.find(".bram_init", pos)
+            if start < 0:
+                break
+            line_end = text.index("\n", start) + 1
+            self.segments.append(text[pos:line_end])
+
+            # Values run until the next blank line or directive
+            end = line_end
+            lines = []
+            while end < len(text):
+                nl = text.find("\n", end)
+                nl = len(text) if nl < 0 else nl + 1
+                line = text[end:nl]
+                if not line.strip() or line.lstrip().startswith("."):
+                    break
+                lines.append(line.split())
+                end = nl
+
+            index = int(text[start:line_end].split()[1])
+            values = np.array([int(v, 16) for l in lines for v in l], dtype=np.uint16)
+            self.segments.append((index, values, [len(l) for l in lines]))
+            pos = end
+        self.segments.append(text[pos:])
+
+    @classmethod
+    def read(cls, filename):
+        with open(filename, "r") as f:
+            return cls(f.read())
+
+    def blocks(self):
+        return [s for s in self.segments if not isinstance(s, str)]
+
+    def patch(self, from_words, to_words, width=32):
+        """Replace the bit slices of from_words with those of to_words. Returns (replaced, patterns)."""
+        depth = len(from_words)
+        table = {}
+        for f, t in zip(_bit_slices(from_words, width, depth), _bit_slices(to_words, width, depth)):
+            key = f.tobytes()
+            if key in table:
+                raise ValueError("from data has repeating bit slices, is it random?")
+            table[key] = t
+
+        replaced = 0
+        for _, values, _ in self.blocks():
+            if len(values) != BRAM_WORDS:
+                continue
+            bits = ((values[:, None] >> np.arange(9, dtype=np.uint16)) & 1).astype(np.uint8).reshape(-1)
+            keys = np.packbits(bits[CANDIDATES], axis=1)
+            hits = [(i, table[k.tobytes()]) for i, k in enumerate(keys) if k.tobytes() in table]
+            if not hits:
+                continue
+            for i, to in hits:
+                bits[CANDIDATES[i]] = np.unpackbits(to)
+            replaced += len(hits)
+            values[:] = (bits.reshape(-1, 9).astype(np.uint16) << np.arange(9, dtype=np.uint16)).sum(axis=1)
+        return replaced, len(table)
+
+    def write(self, filename):
+        out = []
+        for s in self.segments:
+            if isinstance(s, str):
+                out.append(s)
+                continue
+            _, values, per_line = s
+            tokens = [f"{v:03x}" for v in values.tolist()]
+            i = 0
+            for n in per_line:
+                out.append(" ".join(tokens[i:i + n]) + "\n")
+                i += n
+        with open(filename, "w") as f:
+            f.write("".join(out))
+
+
+def patch_config(input_config, output_config, from_file, to_file, width=32):
+    cfg = BramConfig.read(input_config)
+    replaced, patterns = cfg.patch(read_hex(from_file), read_hex(to_file), width)
+    if replaced == 0:
+        raise ValueError(f"{input_config}: none of the {patterns} ROM patterns found, "
+                         "was the gateware built with this random data?")
+    # Like ecpbram, a ROM that is only partly replaced is an error, not a bitstream
+    if replaced < patterns:
+        raise ValueError(f"{input_config}: only {replaced} of the {patterns} ROM patterns found")
+    cfg.write(output_config)
+    return replaced, patterns
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Patch ECP5 BRAM init data in a textual config")
+    parser.add_argument("--input", required=True, help="config written by nextpnr")
+    parser.add_argument("--output", required=True, help="patched config")
+    parser.add_argument("--from", dest="from_file", required=True, help="hex file the ROM was built with")
+    parser.add_argument("--to", dest="to_file", required=True, help="hex file to put in its place")
+    parser.add_argument("--width", type=int, default=32, help="ROM word width (default=32)")
+    parser.add_argument("--verify", action="store_true",
+                        help="also run ecpbram and check the two outputs are identical")
+    args = parser.parse_args()
+
+    replaced, patterns = patch_config(args.input, args.output, args.from_file, args.to_file, args.width)
+    print(f"{replaced}/{patterns} bit slices replaced")
+
+    if args.verify:
+        with tempfile.TemporaryDirectory() as tmp:
+            reference = os.path.join(tmp, "ecpbram.config")
+            subprocess.check_call(["ecpbram", "--input", args.input, "--output", reference,
+                                   "--from", args.from_file, "--to", args.to_file])
+            with open(reference, "rb") as a, open(args.output, "rb") as b:
+                same = a.read() == b.read()
+        print("identical to ecpbram" if same else "DIFFERS from ecpbram")
+        sys.exit(0 if same else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# This file is Copyright (c) Greg Davill <greg.davill@gmail.com>
+# License: BSD
+
+# Incremental firmware build for BaseSoC.PackageFirmware.
+#
+# The generated headers (csr.h, mem.h, soc.h, ...) are written to a scratch
+# directory and only moved over the old ones when their contents differ, so
+# their timestamps only change with the SoC description and make recompiles
+# just the fw/ objects that were touched. On top of that, a hash of the CSR
+# map, the memory map, the generated headers, the fw/ and LiteX software
+# sources and the compiler version is stamped next to oc-fw.bin; when it
+# matches, make isn't run at all. LiteX dates its headers, so comment lines
+# are left out of both comparisons.
+
+import os
+import re
+import shutil
+import hashlib
+import tempfile
+import subprocess
+
+import litex.soc
+
+
+SOURCE_SUFFIXES = (".c", ".h", ".S", ".ld", ".mak", "Makefile")
+
+# libbase, libcompiler_rt, ... that make links into the firmware
+LITEX_SOFTWARE = os.path.join(os.path.dirname(os.path.abspath(litex.soc.__file__)), "software")
+
+# Comment lines: "// Auto-generated by LiteX ... on <date>", "/* ... */", "# ..." but not "#define"
+_COMMENT = re.compile(rb"^\s*(//.*|/\*.*\*/|#(?![a-z!]).*)$", re.MULTILINE)
+
+
+def _contents(path):
+    with open(path, "rb") as f:
+        return _COMMENT.sub(b"", f.read())
+
+
+def generate_includes(builder):
+    """builder._generate_includes(), rewriting only the files that change. Returns their names."""
+    real = builder.generated_dir
+    os.makedirs(os.path.dirname(real), exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".generated-", dir=os.path.dirname(real))
+    try:
+        builder.generated_dir = tmp
+        builder._generate_includes()
+    finally:
+        builder.generated_dir = real
+
+    try:
+        names = sorted(os.listdir(tmp))
+        for name in names:
+            with open(os.path.join(tmp, name), "rb") as f:
+                if tmp.encode() in f.read():
+                    # Something refers to the generated directory by path, generate in place
+                    builder._generate_includes()
+                    return names
+
+        os.makedirs(real, exist_ok=True)
+        changed = []
+        for name in names:
+            new, old = os.path.join(tmp, name), os.path.join(real, name)
+            if not os.path.exists(old) or _contents(new) != _contents(old):
+                os.replace(new, old)
+                changed.append(name)
+        return changed
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _hash_tree(h, root, suffixes):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if not name.endswith(suffixes):
+                continue
+            path = os.path.join(dirpath, name)
+            h.update(os.path.relpath(path, root).encode() + b"\0")
+            h.update(_contents(path))
+            h.update(b"\0")
+
+
+def compiler_version(generated_dir):
+    """First line of the cross compiler's --version, for the TRIPLE in variables.mak."""
+    triple = None
+    try:
+        with open(os.path.join(generated_dir, "variables.mak"), "r") as f:
+            for line in f:
+                if line.startswith("TRIPLE="):
+                    triple = line.split("=", 1)[1].strip()
+    except OSError:
+        pass
+    if triple is None:
+        return "gcc: unknown"
+    try:
+        p = subprocess.run([triple + "-gcc", "--version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        out = p.stdout.decode("ascii", errors="replace").splitlines()
+        return triple + "-gcc: " + (out[0] if out else "")
+    except OSError:
+        return triple + "-gcc: missing"
+
+
+def firmware_key(soc, builder, src_dir):
+    h = hashlib.sha256()
+    h.update(repr(sorted(soc.csr_map.items())).encode())
+    h.update(repr(sorted(soc.mem_map.items())).encode())
+    h.update(compiler_version(builder.generated_dir).encode())
+    _hash_tree(h, builder.generated_dir, ("",))
+    _hash_tree(h, src_dir, SOURCE_SUFFIXES)
+    _hash_tree(h, LITEX_SOFTWARE, SOURCE_SUFFIXES)
+    return h.hexdigest()
+
+
+class Stamp:
+    """Remembers the key an output was last built from."""
+    def __init__(self, output):
+        self.output = output
+        self.filename = output + ".stamp"
+
+    def matches(self, key):
+        try:
+            with open(self.filename, "r") as f:
+                return f.read().strip() == key and os.path.exists(self.output)
+        except OSError:
+            return False
+
+    def write(self, key):
+        with open(self.filename, "w") as f:
+            f.write(key + "\n")
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+# This file is Copyright (c) Greg Davill <greg.davill@gmail.com>
+# License: BSD
+
+# Firmware image -> ROM words, and ROM words -> oc-fw.init for brampatch.
+#
+# oc-fw.bin is memory mapped and viewed as an array of 32 bit words in the
+# CPU's byte order, no copy is made. The same array is handed to
+# soc.initialize_rom() through RomWords, and the .init file is formatted in
+# one go by numpy instead of one "{:08x}" per word.
+#
+# Benchmark against the old get_mem_data + string concatenation, up to 1 MiB:
+#   python3 fwinit.py --bench
+
+import os
+import mmap
+import struct
+import argparse
+import tempfile
+
+from collections.abc import Sequence
+from time import perf_counter
+
+import numpy as np
+
+
+# byte -> its two hex digits
+_HEX = np.frombuffer(b"".join(b"%02x" % i for i in range(256)), dtype=np.uint8).reshape(256, 2)
+
+
+class RomWords(Sequence):
+    """Read-only sequence of ints over a word array, what initialize_rom() expects of a list."""
+    def __init__(self, array):
+        self.array = array
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return RomWords(self.array[i])
+        return int(self.array[i])
+
+    def __iter__(self):
+        return map(int, self.array)
+
+
+def load_firmware(filename, endianness="little"):
+    """Words of a firmware image, like litex's get_mem_data() but backed by the file itself."""
+    dtype = np.dtype("<u4" if endianness == "little" else ">u4")
+    size = os.path.getsize(filename)
+    if size == 0:
+        return RomWords(np.zeros(0, dtype=dtype))
+
+    with open(filename, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    words = np.frombuffer(mm, dtype=dtype, count=size // 4)
+    if size % 4:
+        # Zero pad a trailing partial word, this one needs a copy
+        tail = np.frombuffer(mm[size // 4 * 4:] + bytes(4 - size % 4), dtype=dtype)
+        words = np.concatenate([words, tail])
+    return RomWords(words)
+
+
+def format_init(words):
+    """Bytes of an init file, one 8 digit hex word per line."""
+    w = np.asarray(words.array if isinstance(words, RomWords) else words).astype(">u4")
+    out = np.empty((len(w), 9), dtype=np.uint8)
+    out[:, :8] = _HEX[w.view(np.uint8).reshape(-1, 4)].reshape(-1, 8)
+    out[:, 8] = ord("\n")
+    return out.tobytes()
+
+
+def write_init(words, output_file):
+    with open(output_file, "wb") as o:
+        o.write(format_init(words))
+
+
+# Benchmark ----------------------------------------------------------------------------------------
+
+def _reference(filename, endianness="little"):
+    # What OrangeCrab-bitstream.py did before: get_mem_data() then CreateFirmwareInit()
+    data = []
+    with open(filename, "rb") as f:
+        while True:
+            w = f.read(4)
+            if not w:
+                break
+            w += bytes(4 - len(w))
+            data.append(struct.unpack("<I" if endianness == "little" else ">I", w)[0])
+    content = ""
+    for d in data:
+        content += "{:08x}\n".format(d)
+    return data, content.encode("ascii")
+
+
+def bench(sizes):
+    print(f"{'size':>9s}{'before':>12s}{'after':>12s}{'speedup':>9s}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            filename = os.path.join(tmp, "oc-fw.bin")
+            with open(filename, "wb") as f:
+                f.write(os.urandom(size))
+
+            t = perf_counter()
+            data, content = _reference(filename)
+            before = perf_counter() - t
+
+            t = perf_counter()
+            words = load_firmware(filename)
+            init = format_init(words)
+            after = perf_counter() - t
+
+            assert init == content and list(words) == data
+            del words
+            print(f"{size // 1024:7d}Ki{before * 1e3:10.2f}ms{after * 1e3:10.2f}ms{before / after:8.0f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a firmware image to a ROM init file")
+    parser.add_argument("input", nargs="?", help="firmware image, e.g. oc-fw.bin")
+    parser.add_argument("output", nargs="?", help="init file to write")
+    parser.add_argument("--endianness", default="little", choices=["little", "big"])
+    parser.add_argument("--bench", action="store_true",
+                        help="time the conversion for ROM sizes from 32KiB to 1MiB")
+    args = parser.parse_args()
+
+    if args.bench:
+        bench([32 * 1024 << i for i in range(6)])
+    elif args.input and args.output:
+        write_init(load_firmware(args.input, args.endianness), args.output)
+    else:
+        parser.error("input and output are required")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# This file is Copyright (c) Greg Davill <greg.davill@gmail.com>
+# License: BSD
+
+# Content addressed cache of place and route results.
+#
+# The key is a hash of everything yosys/nextpnr get to see: the elaborated
+# Verilog and memory init files, the constraints, the build script with its
+# toolchain arguments, and the versions of the tools themselves. Anything that
+# changes the SoC (BaseSoC parameters, rtl/ sources, deps/ revisions, --device,
+# trellis args) changes one of those, so a hit is safe to reuse. Files the
+# build scripts read by absolute path from outside the build directory, like
+# the CPU core in deps/, are hashed by content, and absolute paths are cut
+# down to file names, so checkouts in different places share entries.
+#
+# The cache directory can be shared between machines (e.g. on NFS): entries
+# are written to a temporary directory and renamed into place, so a reader
+# never sees half an entry. Each entry keeps the toolchain's output next to
+# the bitstream, so a hit can replay nextpnr's timing and utilization report.
+
+import os
+import re
+import sys
+import shutil
+import hashlib
+import tempfile
+import subprocess
+
+
+# Inputs to the toolchain, as written by builder.build(run=False)
+INPUT_SUFFIXES = (".v", ".init", ".lpf", ".ys", ".sh")
+
+# Outputs reused on a hit
+OUTPUT_SUFFIXES = (".config", ".bit", ".svf", ".pnr.log")
+
+# What yosys/nextpnr printed, see run_toolchain()
+LOG_SUFFIX = ".pnr.log"
+
+TOOLS = [["yosys", "-V"], ["nextpnr-ecp5", "--version"], ["ecppack", "--help"]]
+
+# Comments carry build dates and paths, leave them out of the key
+_COMMENT = re.compile(rb"^\s*(//|#(?!!)).*$", re.MULTILINE)
+
+# Absolute paths in the build scripts, e.g. "read_verilog /.../deps/.../VexRiscv.v" or "-I/..."
+_ABSPATH = re.compile(rb"(?:^|(?<=[\s\"'{=])|(?<=-[A-Za-z]))(/[^\s\"'{};]+)", re.MULTILINE)
+
+
+def tool_versions():
+    versions = []
+    for cmd in TOOLS:
+        try:
+            p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            out = p.stdout.decode("ascii", errors="replace").splitlines()
+            versions.append(cmd[0] + ": " + (out[0] if out else ""))
+        except OSError:
+            versions.append(cmd[0] + ": missing")
+    return versions
+
+
+def _normalise_paths(data, external):
+    """Cut absolute paths down to their file name, so checkouts in different places
+    share keys. Existing files outside gateware_dir are added to 'external'."""
+    def short(m):
+        path = os.fsdecode(m.group(1))
+        if os.path.isfile(path):
+            external.add(path)
+        return os.fsencode(os.path.basename(path))
+    return _ABSPATH.sub(short, data)
+
+
+def run_toolchain(gateware_dir, build_name):
+    """Run the build script LiteX wrote, passing its output through and keeping a copy in
+    <build_name>.pnr.log for the cache."""
+    with open(os.path.join(gateware_dir, build_name + LOG_SUFFIX), "wb") as log:
+        p = subprocess.Popen(["bash", f"build_{build_name}.sh"], cwd=gateware_dir,
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        out = getattr(sys.stdout, "buffer", None)
+        for line in p.stdout:
+            log.write(line)
+            if out is not None:
+                out.write(line)
+                out.flush()
+        if p.wait() != 0:
+            raise subprocess.CalledProcessError(p.returncode, p.args)
+
+
+def gateware_key(gateware_dir, extra=()):
+    """sha256 over the toolchain inputs in gateware_dir, everything the build scripts read
+    from elsewhere (e.g. the CPU core from deps/), plus any extra strings."""
+    h = hashlib.sha256()
+    for line in list(extra) + tool_versions():
+        h.update(line.encode() + b"\n")
+
+    gateware_dir = os.path.abspath(gateware_dir)
+    external = set()
+    for name in sorted(os.listdir(gateware_dir)):
+        if not name.endswith(INPUT_SUFFIXES):
+            continue
+        with open(os.path.join(gateware_dir, name), "rb") as f:
+            data = f.read()
+        h.update(name.encode() + b"\0")
+        h.update(_normalise_paths(_COMMENT.sub(b"", data), external))
+        h.update(b"\0")
+
+    # Their contents, not their paths, in an order that doesn't depend on where they are
+    external = [p for p in external if os.path.dirname(os.path.abspath(p)) != gateware_dir]
+    for path in sorted(external, key=lambda p: (os.path.basename(p), p)):
+        with open(path, "rb") as f:
+            data = f.read()
+        h.update(os.path.basename(path).encode() + b"\0")
+        h.update(_COMMENT.sub(b"", data))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class GatewareCache:
+    def __init__(self, root):
+        self.root = root
+
+    def _entry(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def fetch(self, key, gateware_dir, build_name):
+        """Copy the outputs of a previous build into gateware_dir. Returns False on a miss."""
+        entry = self._entry(key)
+        if not os.path.exists(os.path.join(entry, build_name + ".config")):
+            return False
+        for name in os.listdir(entry):
+            suffix = next((s for s in OUTPUT_SUFFIXES if name.endswith(s)), os.path.splitext(name)[1])
+            shutil.copyfile(os.path.join(entry, name), os.path.join(gateware_dir, build_name + suffix))
+        return True
+
+    def store(self, key, gateware_dir, build_name):
+        entry = self._entry(key)
+        if os.path.exists(entry):
+            return
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(entry), prefix=".tmp-")
+        try:
+            for suffix in OUTPUT_SUFFIXES:
+                src = os.path.join(gateware_dir, build_name + suffix)
+                if os.path.exists(src):
+                    shutil.copyfile(src, os.path.join(tmp, build_name + suffix))
+            os.rename(tmp, entry)
+        except OSError:
+            # Someone else stored the same build first
+            shutil.rmtree(tmp, ignore_errors=True)
@@ -8,6 +8,12 @@ import sys
 import os
 import subprocess
 import argparse
+import json
+import hashlib
+try:
+    import fcntl
+except ImportError:
+    fcntl = None    # Windows, state updates aren't locked
 
 
 DEPS_DIR = "deps"
@@ -31,6 +37,9 @@ OPTIONAL_DEPS = {
     'usb':          'https://github.com/pyusb/pyusb.git',
 }
 
+# Results of earlier runs (git state, ...), so warm starts can skip the work
+STATE_FILE = "build" + os.path.sep + ".lxbuildenv-state.json"
+
 # Obtain the path to this script, plus a trailing separator.  This will
 # be used later on to construct various environment variables for paths
 # to a variety of support directories.
@@ -310,8 +319,126 @@ def check_module(root_path, depth, verbose=False, recursive=True, breadcrumbs=[]
                     return True
     return False
 
+def load_state(script_path):
+    try:
+        with open(script_path + STATE_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+# Set one entry of the state file. Parallel builds (OrangeCrab-matrix.py) share it,
+# so the file is re-read and written back under a lock, and other builds' entries
+# written since load_state() are kept.
+def update_state(script_path, name, value):
+    filename = script_path + STATE_FILE
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename + ".lock", 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            state = load_state(script_path)
+            state[name] = value
+            tmp = "{}.{}".format(filename, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(state, f, indent=1)
+            os.replace(tmp, filename)
+    except OSError:
+        pass
+
+# Find the work tree and git directory containing path, without running git
+def find_git_dir(path):
+    path = os.path.abspath(path)
+    while True:
+        dot_git = path + os.path.sep + '.git'
+        if os.path.isdir(dot_git):
+            return (path, dot_git)
+        if os.path.isfile(dot_git):
+            # Submodules have a gitlink: "gitdir: ../../.git/modules/hw/deps/litex"
+            with open(dot_git, 'r') as f:
+                line = f.read().strip()
+            if line.startswith('gitdir:'):
+                return (path, os.path.normpath(os.path.join(path, line[7:].strip())))
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+def _file_state(filename, contents=False):
+    try:
+        if contents:
+            with open(filename, 'r') as f:
+                return f.read().strip()
+        st = os.stat(filename)
+        return "{}:{}".format(st.st_mtime_ns, st.st_size)
+    except OSError:
+        return "missing"
+
+def _git_state(top, git_dir, recursive, parts):
+    head = _file_state(git_dir + os.path.sep + 'HEAD', contents=True)
+    parts.append(top + ' HEAD ' + head)
+    if head.startswith('ref:'):
+        ref = head[4:].strip()
+        parts.append(ref + ' ' + _file_state(git_dir + os.path.sep + ref.replace('/', os.path.sep), contents=True))
+    parts.append('packed-refs ' + _file_state(git_dir + os.path.sep + 'packed-refs'))
+    parts.append('index ' + _file_state(git_dir + os.path.sep + 'index'))
+
+    gitmodules = top + os.path.sep + '.gitmodules'
+    if not os.path.isfile(gitmodules):
+        return
+    parts.append('.gitmodules ' + _file_state(gitmodules))
+    with open(gitmodules, 'r') as f:
+        for line in f:
+            parts_ = line.split("=", 2)
+            if parts_[0].strip() != "path":
+                continue
+            sub = top + os.path.sep + parts_[1].strip()
+            found = find_git_dir(sub) if os.path.exists(sub + os.path.sep + '.git') else None
+            if found is None:
+                parts.append(sub + ' missing')
+            elif recursive:
+                _git_state(found[0], found[1], recursive, parts)
+            else:
+                parts.append(sub + ' HEAD ' + _file_state(found[1] + os.path.sep + 'HEAD', contents=True))
+
+# A hash of everything `git submodule` and `git rev-parse HEAD` depend on:
+# HEAD and the branch it points to, the index, and the gitlink of every
+# submodule. None if script_path isn't in a git checkout.
+def git_state_key(script_path, recursive=False):
+    found = find_git_dir(script_path)
+    if found is None:
+        return None
+    parts = ['recursive' if recursive else 'shallow']
+    _git_state(found[0], found[1], recursive, parts)
+    return hashlib.sha1('\n'.join(parts).encode()).hexdigest()
+
+# Short hash of HEAD, only asking git when the checkout changed since last time
+def repo_git_sha1(script_path=script_path):
+    key = git_state_key(script_path)
+    state = load_state(script_path)
+    cached = state.get('repo-git-sha1', {})
+    if key is not None and cached.get('key') == key:
+        return cached['sha1']
+
+    git_rev_cmd = subprocess.Popen(["git", "rev-parse", "--short", "HEAD"],
+                    cwd=script_path,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE)
+    (git_stdout, _) = git_rev_cmd.communicate()
+    sha1 = git_stdout.decode('ascii').strip('\n')
+    if key is not None and git_rev_cmd.returncode == 0:
+        update_state(script_path, 'repo-git-sha1', {'key': key, 'sha1': sha1})
+    return sha1
+
 # Determine whether we need to invoke "git submodules init --recurse"
 def check_submodules(script_path, args):
+    # Nothing git looks at has changed since the last check passed
+    key = git_state_key(script_path, args.lx_recursive_git)
+    state = load_state(script_path)
+    if key is not None and state.get('submodules') == key:
+        if args.lx_verbose and not args.lx_quiet:
+            print("lxbuildenv: Submodule check: unchanged since last run")
+        return
+
     if check_module(script_path, 0, verbose=args.lx_verbose, recursive=args.lx_recursive_git):
         if not args.lx_quiet:
             print("lxbuildenv: Missing git submodules -- updating")
@@ -321,8 +448,10 @@ def check_submodules(script_path, args):
         if args.lx_recursive_git:
             git_cmd.append("--recursive")
         subprocess.Popen(git_cmd, cwd=script_path).wait()
-    elif args.lx_verbose:
-        if not args.lx_quiet:
+    else:
+        if key is not None:
+            update_state(script_path, 'submodules', key)
+        if args.lx_verbose and not args.lx_quiet:
             print("lxbuildenv: Submodule check: Submodules found")
 
 
@@ -350,6 +479,8 @@ def lx_main(args):
     elif args.lx_print_deps:
         lx_print_deps()
 
+    elif args.lx_bench is not None:
+        lx_bench(args.lx_bench, ["riscv", "nextpnr-ecp5", "yosys"])
     elif args.lx_run is not None:
         script_name=args.lx_run[0]
         config = read_configuration(script_name, args)
@@ -507,6 +638,39 @@ if __name__ == "__main__":
         return False
     return True
 
+# Time how long a script takes to reach the first line of its main(), with the
+# state file removed (cold) and left in place (warm)
+def lx_bench(runs, dependencies):
+    import time
+    probe = script_path + '.lxbuildenv-bench.py'
+    with open(probe, 'w') as p:
+        p.write("LX_DEPENDENCIES = {}\n".format(repr(dependencies)))
+        p.write("import time\nimport lxbuildenv\n\n")
+        p.write("def main():\n    print(time.time())\n\n")
+        p.write("if __name__ == '__main__':\n    main()\n")
+
+    def start(cold):
+        if cold:
+            try:
+                os.remove(script_path + STATE_FILE)
+            except OSError:
+                pass
+        t = time.time()
+        out = subprocess.check_output([sys.executable, probe, '--lx-quiet', '--lx-ignore-deps'],
+                                      cwd=script_path, stderr=subprocess.DEVNULL)
+        return float(out.decode('ascii').split()[-1]) - t
+
+    try:
+        results = {}
+        for name, cold in (('cold', True), ('warm', False)):
+            times = sorted(start(cold) for _ in range(runs))
+            results[name] = times
+            print('lxbuildenv: {}: median {:.1f}ms, min {:.1f}ms, max {:.1f}ms ({} runs)'.format(
+                name, times[len(times) // 2] * 1e3, times[0] * 1e3, times[-1] * 1e3, runs))
+    finally:
+        os.remove(probe)
+    return results
+
 # For the main command, parse args and hand it off to main()
 def main():
     parser = argparse.ArgumentParser(
@@ -536,6 +700,9 @@ def main():
     parser.add_argument(
         "--lx-verbose", help="increase verboseness of some processes", action="store_true"
     )
+    parser.add_argument(
+        '--bench', '--lx-bench', dest='lx_bench', metavar='N', type=int, help="time N cold and N warm starts of a script up to its main()"
+    )
     parser.add_argument(
         '-r', '--run', '--lx-run', dest='lx_run', help="run the given script under lxbuildenv", nargs=argparse.REMAINDER
     )
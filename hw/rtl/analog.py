@@ -2,8 +2,10 @@
 # Adapted from code by Sylvain Munaut <tnt@246tNt.com> https://github.com/smunaut/ice40-playground/blob/icepick/projects/icepick_test/rtl/sense.v
 
 from migen import *
+from migen.genlib.fifo import SyncFIFO
 
 from litex.soc.interconnect.csr import AutoCSR, CSRStorage, CSRField, CSRStatus
+from litex.soc.interconnect.csr_eventmanager import EventManager, EventSourcePulse
 from litex.soc.doc.module import ModuleDoc
 
 from litex.build.io import DDRInput
@@ -20,8 +22,17 @@ class AnalogSense(Module, AutoCSR, ModuleDoc):
     
     Making use of external RC circuit and FPGA differential inputs.
     An external Analog Mux is used to enable multilp channels.
+
+    A scan converts every channel set in ``scan.mask`` back to back, lowest
+    channel first, and pushes the results into a FIFO to be read from
+    ``scan_result`` and popped with ``scan_pop``. The ``done`` event fires when
+    the last one is in. Single conversions through ``control`` shouldn't be
+    started while a scan is busy.
+
+    With ``ddr_input=False`` the two comparator samples per clock are left
+    in ``sense_iob`` for a testbench to drive, see ``analogsim.py``.
     """
-    def __init__(self, pads):
+    def __init__(self, pads, ddr_input=True, fifo_depth=16):
 
         charge_measurement = Signal(24)
         
@@ -35,7 +46,7 @@ class AnalogSense(Module, AutoCSR, ModuleDoc):
         ]
 
         # CPU interface exposed through CSRs
-        self._control = CSRStorage(fields=[
+        self._control = CSRStorage(name="control", fields=[
             CSRField("start", size=1, offset=0, pulse=True, description="Write ``1`` to start a conversion"),
             CSRField("chan", size=4, offset=8, description="Channel selector for ADC", values= [
                         ("0b0000", "GND"),
@@ -53,29 +64,94 @@ class AnalogSense(Module, AutoCSR, ModuleDoc):
                         ("0b1111", "VBAT"), # Through 1/2 divider
                     ]),
         ])
-        self._status   = CSRStatus(fields=[
+        self._status   = CSRStatus(name="status", fields=[
             CSRField("idle", size=1, offset=0, description="Measurement complete when read as ``1``.")
         ], description="AnalogSense Status.")
-        self._result   = CSRStatus(24, description="Conversion result.")
+        self._result   = CSRStatus(24, name="result", description="Conversion result.")
+
+        # Phase durations, in cycles of the 48MHz clock plus one. The reset values are the
+        # original fixed timings.
+        self._setup     = CSRStorage(24, name="setup", reset=0x8000,
+                            description="Cycles for the mux to settle before charging (``0x8000`` = 680us).")
+        self._charge    = CSRStorage(24, name="charge", reset=0x8000,
+                            description="Maximum cycles of charge, results saturate at twice this (``0x8000`` = 680us).")
+        self._discharge = CSRStorage(24, name="discharge", reset=0x20000,
+                            description="Cycles to discharge the capacitor after a conversion (``0x20000`` = 2.73ms).")
+        self._mode      = CSRStorage(name="mode", fields=[
+            CSRField("early", size=1, offset=0, description="End the charge phase once the comparator settles"),
+            CSRField("settle", size=16, offset=16, reset=64,
+                        description="Cycles the comparator has to read low in a row to count as settled"),
+        ])
+
+        self._scan        = CSRStorage(name="scan", fields=[
+            CSRField("mask", size=16, offset=0, description="Channels to convert, bit ``n`` for channel ``n``"),
+            CSRField("start", size=1, offset=16, pulse=True, description="Write ``1`` to start a scan"),
+        ])
+        self._scan_status = CSRStatus(name="scan_status", fields=[
+            CSRField("busy", size=1, offset=0, description="Scan in progress"),
+            CSRField("readable", size=1, offset=1, description="Results waiting in the FIFO"),
+            CSRField("level", size=bits_for(fifo_depth), offset=8, description="Number of results in the FIFO"),
+        ])
+        self._scan_result = CSRStatus(name="scan_result", fields=[
+            CSRField("result", size=24, offset=0, description="Conversion result at the head of the FIFO"),
+            CSRField("chan", size=4, offset=24, description="Channel it was converted from"),
+        ])
+        self._scan_pop    = CSRStorage(name="scan_pop", fields=[
+            CSRField("pop", size=1, offset=0, pulse=True, description="Write ``1`` to drop the head of the FIFO"),
+        ])
+
+        self.submodules.ev = EventManager()
+        self.ev.done = EventSourcePulse(description="Scan complete, all its results are in the FIFO")
+        self.ev.finalize()
+
+        fifo = SyncFIFO(28, fifo_depth)
+        self.submodules += fifo
+
+        # Scan sequencer, picks the lowest channel still pending
+        pending = Signal(16)
+        scan_chan = Signal(4)
+        scan_bit = Signal(16)
+        scan_go = Signal()
+        for i in reversed(range(16)):
+            self.comb += If(pending[i], scan_chan.eq(i), scan_bit.eq(1 << i))
+        self.comb += scan_go.eq(~self._control.fields.start & (pending != 0) & fifo.writable)
+
+        # A conversion started by the CPU or by the scan
+        start = Signal()
+        chan = Signal(4)
+        conv_chan = Signal(4)
+        conv_scan = Signal()
+        self.comb += [
+            start.eq(self._control.fields.start | scan_go),
+            chan.eq(Mux(self._control.fields.start, self._control.fields.chan, scan_chan)),
+        ]
 
         # FSM
         fsm = FSM(reset_state="IDLE")
         self.submodules += fsm
-        timer = Signal(18)
+        timer = Signal(24)
         timer_trig = Signal()
+        settled = Signal()
+        charge_done = Signal()
 
-        fsm.act("IDLE",      If(self._control.fields.start, NextState("SETUP")),   NextValue(timer, 0x18000))   # 680us
-        fsm.act("SETUP",     If(timer_trig,                 NextState("CHARGE"),   NextValue(timer, 0x18000)))  # 680us
-        fsm.act("CHARGE",    If(timer_trig,                 NextState("DISCHARGE"),NextValue(timer, 0x0) ))     # 2.73ms
-        fsm.act("DISCHARGE", If(timer_trig,                 NextState("IDLE"))) 
+        fsm.act("IDLE",      If(start,                      NextState("SETUP")),   NextValue(timer, self._setup.storage))
+        fsm.act("SETUP",     If(timer_trig,                 NextState("CHARGE"),   NextValue(timer, self._charge.storage)))
+        fsm.act("CHARGE",    If(charge_done,                NextState("DISCHARGE"),NextValue(timer, self._discharge.storage)))
+        fsm.act("DISCHARGE", If(timer_trig,                 NextState("IDLE")))
 
         # Timers
-        self.sync += timer.eq(timer + 1)
-        self.comb += timer_trig.eq(timer[17])
+        self.sync += timer.eq(timer - 1)
+        self.comb += [
+            timer_trig.eq(timer == 0),
+            charge_done.eq(timer_trig | (self._mode.fields.early & settled)),
+        ]
 
         # Input 
         sense_iob = Signal(2)
-        self.specials += DDRInput(pads.sense_p, sense_iob[0], sense_iob[1])
+        if ddr_input:
+            self.specials += DDRInput(pads.sense_p, sense_iob[0], sense_iob[1])
+        else:
+            self.sense_iob = sense_iob
 
         sense_value = Signal(2)
         self.sync += sense_value.eq(Cat(
@@ -83,6 +159,16 @@ class AnalogSense(Module, AutoCSR, ModuleDoc):
                 sense_iob[0] & sense_iob[1]
             ))
         
+        # Once the capacitor is above the input the comparator stays low, nothing is
+        # left to count
+        quiet = Signal(16)
+        self.sync += If(sense_value != 0,
+                quiet.eq(0)
+            ).Elif(quiet != 0xffff,
+                quiet.eq(quiet + 1)
+            )
+        self.comb += settled.eq(quiet >= self._mode.fields.settle)
+
         # Measurement Counters
         sense_counter = Signal(24)
         self.sync += [
@@ -96,13 +182,41 @@ class AnalogSense(Module, AutoCSR, ModuleDoc):
         # Control Hardware
         self.sync += [
             If(fsm.ongoing("IDLE"),
-                sense_mux.eq(Mux(self._control.fields.start,
-                    self._control.fields.chan, 0)),
-                sense_enable_n.eq(~self._control.fields.start)
+                sense_mux.eq(Mux(start, chan, 0)),
+                sense_enable_n.eq(~start),
+                If(start,
+                    conv_chan.eq(chan),
+                    conv_scan.eq(scan_go)
+                )
             ),
             sense_ctrl.eq(fsm.ongoing("CHARGE")),
         ]
 
+        # Scan Hardware
+        busy = Signal()
+        busy_d = Signal()
+        self.sync += [
+            If(self._scan.fields.start,
+                pending.eq(self._scan.fields.mask)
+            ).Elif(fsm.ongoing("IDLE") & scan_go,
+                pending.eq(pending & ~scan_bit)
+            ),
+            busy_d.eq(busy),
+        ]
+        self.comb += [
+            busy.eq((pending != 0) | (conv_scan & ~fsm.ongoing("IDLE"))),
+            fifo.din.eq(Cat(sense_counter, conv_chan)),
+            fifo.we.eq(fsm.ongoing("CHARGE") & charge_done & conv_scan),
+            fifo.re.eq(self._scan_pop.fields.pop),
+            self.ev.done.trigger.eq(busy_d & ~busy),
+
+            self._scan_status.fields.busy.eq(busy),
+            self._scan_status.fields.readable.eq(fifo.readable),
+            self._scan_status.fields.level.eq(fifo.level),
+            self._scan_result.fields.result.eq(fifo.dout[:24]),
+            self._scan_result.fields.chan.eq(fifo.dout[24:]),
+        ]
+
         # IF
         self.comb += [
             self._status.fields.idle.eq(fsm.ongoing("IDLE")),
@@ -110,5 +224,5 @@ class AnalogSense(Module, AutoCSR, ModuleDoc):
         ]
 
         # Save result of charge time
-        self.sync += If(fsm.ongoing("CHARGE") & timer_trig, 
+        self.sync += If(fsm.ongoing("CHARGE") & charge_done, 
                         charge_measurement.eq(sense_counter))
\ No newline at end of file
@@ -7,8 +7,12 @@ import os
 import math
 import builtins
 import statistics
+import argparse
+import tempfile
 
-from time import sleep, localtime, strftime
+from time import sleep, monotonic, localtime, strftime
+
+from octest import flow
 
 # https://stackoverflow.com/questions/4417546/constantly-print-subprocess-output-while-process-is-running
 def execute(command):
@@ -55,15 +59,70 @@ class _GetchWindows:
 getch = _Getch()
 
 
+def bench(n, test_args):
+    """Time what each board pays before its first stage, in a new interpreter vs. in this one."""
+    with tempfile.TemporaryDirectory() as tmp:
+        test_args = test_args + ["--log-dir", tmp, "--results-db", os.path.join(tmp, "results.db")]
+
+        code = ("import sys; from octest import flow; flow.setup(flow.parse_args(sys.argv[1:])); "
+                "flow.reset(); flow.runlog.close('bench'); flow.close()")
+        spawn = []
+        for i in range(n):
+            start = monotonic()
+            subprocess.check_call([sys.executable, "-c", code] + test_args)
+            spawn.append(monotonic() - start)
+
+        flow.setup(flow.parse_args(test_args))
+        warm = []
+        for i in range(n):
+            start = monotonic()
+            flow.reset()
+            warm.append(monotonic() - start)
+            flow.runlog.close('bench')
+        flow.close()
+
+    for name, t in (("spawn", spawn), ("in-process", warm)):
+        print(f"{name:12s} mean {statistics.mean(t) * 1e3:8.2f} ms, "
+              f"min {min(t) * 1e3:8.2f} ms, max {max(t) * 1e3:8.2f} ms")
+
+
+parser = argparse.ArgumentParser(description="Test OrangeCrab boards one after another, SPACE starts the next one",
+                                 epilog="Other arguments are passed on to the test, see OrangeCrab-tests.py --help")
+parser.add_argument("--spawn", action="store_true",
+                    help="start OrangeCrab-tests.py in a new interpreter for every board")
+parser.add_argument("--bench", type=int, default=None, metavar="N",
+                    help="compare the per-board startup time of both modes over N runs, then exit")
+args, test_args = parser.parse_known_args()
+
+if args.bench is not None:
+    bench(args.bench, test_args)
+    sys.exit(0)
+
+# The test flow stays loaded, with its hotplug watcher, results writer and caches, between boards
+if not args.spawn:
+    flow.setup(flow.parse_args(test_args))
+
 while True:
     # Wait for SPACE, exit on any other input
     print("\n\n  -=-=  Press SPACE to run OrangeCrab tests, Any other key to exit  =-=-\n\n")
     c = getch()
 
     if c == ' ':
-        try:
-            execute(["python3", "OrangeCrab-tests.py"])
-        except:
-            ...
+        if args.spawn:
+            try:
+                execute([sys.executable, "OrangeCrab-tests.py"] + test_args)
+            except:
+                ...
+        else:
+            try:
+                flow.run_test()
+            except KeyboardInterrupt:
+                break
+            except Exception:
+                print("--- Test aborted ---")
+                print(" Error:", sys.exc_info()[1])
     else:
-        break
\ No newline at end of file
+        break
+
+if not args.spawn:
+    flow.close()
\ No newline at end of file
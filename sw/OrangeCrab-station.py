@@ -0,0 +1,131 @@
+# This file is part of OrangeCrab-test
+# Copyright 2020 Gregory Davill <greg.davill@gmail.com>
+
+# Run the OrangeCrab test flow on several fixture slots at once.
+# Each slot is bound to a USB topology path (CDC + DFU) and a JTAG adapter,
+# and runs OrangeCrab-tests.py as its own process with its own log directory.
+# Slots that share a JTAG adapter, a USB bus or the operator take turns on
+# those stages through shared locks, and overlap everywhere else.
+#
+#   python3 OrangeCrab-station.py --slot A,usb=1-1.2,jtag=d:001/004 \
+#                                 --slot B,usb=1-1.3,jtag=d:001/005
+
+import subprocess
+import sys
+import os
+import argparse
+import threading
+
+from time import monotonic, localtime, strftime
+
+from octest.stages import read_report, utilization
+
+
+BRIGHTGREEN = '\033[92;1m'
+BRIGHTRED = '\033[91;1m'
+ENDC = '\033[0m'
+
+sw_dir = os.path.dirname(os.path.abspath(__file__))
+
+print_lock = threading.Lock()
+
+
+class Slot:
+    def __init__(self, name, usb=None, jtag=None, port=None):
+        self.name = name
+        self.usb = usb
+        self.jtag = jtag
+        self.port = port
+
+        self.result = None
+        self.duration = None
+        self.report = None
+
+    @staticmethod
+    def parse(spec):
+        # "<name>,usb=<path>,jtag=<device string>,port=<serial device>"
+        name, *options = spec.split(',')
+        kwargs = {}
+        for o in options:
+            key, value = o.split('=', 1)
+            if key not in ("usb", "jtag", "port"):
+                raise argparse.ArgumentTypeError(f"unknown slot option '{key}'")
+            kwargs[key] = value
+        return Slot(name, **kwargs)
+
+    def command(self, log_dir, lock_dir, results_db):
+        cmd = [sys.executable, "-u", "OrangeCrab-tests.py", "--log-dir", log_dir,
+               "--slot", self.name, "--lock-dir", lock_dir, "--stage-report", self.report,
+               "--results-db", results_db]
+        if self.usb is not None:
+            cmd += ["--usb-path", self.usb]
+        if self.jtag is not None:
+            cmd += ["--jtag", self.jtag]
+        if self.port is not None:
+            cmd += ["--port", self.port]
+        return cmd
+
+    def run(self, log_root):
+        log_dir = os.path.join(log_root, self.name)
+        os.makedirs(os.path.join(sw_dir, log_dir), exist_ok=True)
+
+        current_time = strftime("%Y-%m-%d-%H:%M:%S", localtime())
+        console_log = os.path.join(sw_dir, log_dir, f"console-{current_time}.txt")
+        self.report = os.path.join(sw_dir, log_dir, f"stages-{current_time}.jsonl")
+        lock_dir = os.path.join(sw_dir, log_root, "locks")
+        results_db = os.path.join(sw_dir, log_root, "results.db")
+
+        start = monotonic()
+        with open(console_log, "w") as f:
+            cmd = subprocess.Popen(self.command(log_dir, lock_dir, results_db), cwd=sw_dir,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+            for line in cmd.stdout:
+                line = line.decode('ascii', errors='replace').rstrip("\r\n")
+                f.write(line + '\n')
+                with print_lock:
+                    print(f"[{self.name}] {line}")
+            cmd.wait()
+        self.duration = monotonic() - start
+        self.result = "PASS" if cmd.returncode == 0 else "FAIL"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OrangeCrab multi-fixture test station")
+    parser.add_argument("--slot", dest="slots", action="append", type=Slot.parse, required=True,
+                        help="fixture slot: <name>[,usb=<usb path>][,jtag=<ecpprog device>][,port=<serial device>]")
+    parser.add_argument("--log-dir", default="log",
+                        help="root directory for per-slot logs (default=log)")
+    args = parser.parse_args()
+
+    names = [s.name for s in args.slots]
+    if len(set(names)) != len(names):
+        parser.error("slot names must be unique")
+
+    start = monotonic()
+    threads = [threading.Thread(target=s.run, args=(args.log_dir,), name=s.name) for s in args.slots]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    total = monotonic() - start
+
+    print("\n-- Station summary")
+    for s in args.slots:
+        colour = BRIGHTGREEN if s.result == "PASS" else BRIGHTRED
+        print(colour + f"  {s.name:8s}{s.result:6s}{s.duration:8.1f}s" + ENDC)
+    print(f"  {len(args.slots)} slots in {total:.1f}s")
+
+    records = []
+    for s in args.slots:
+        if os.path.exists(s.report):
+            records += read_report(s.report)
+    print("\n-- Stage utilization")
+    for l in utilization(records):
+        print(l)
+
+    sys.exit(0 if all(s.result == "PASS" for s in args.slots) else 1)
+
+
+if __name__ == "__main__":
+    main()
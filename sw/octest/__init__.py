@@ -0,0 +1,4 @@
+# This file is part of OrangeCrab-test
+# Copyright 2020 Gregory Davill <greg.davill@gmail.com>
+
+# Host side helpers shared by the OrangeCrab test scripts in sw/
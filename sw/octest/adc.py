@@ -0,0 +1,115 @@
+# This file is part of OrangeCrab-test
+# Copyright 2020 Gregory Davill <greg.davill@gmail.com>
+
+# Host side model and analysis of the AnalogSense RC ADC.
+#
+# The FPGA counts how long the sense comparator sees the RC node below the
+# input while charging, so the input voltage follows the RC charge curve
+# Vchg(t) = Vs * (1 - exp(-(t + 200) / K)).
+
+import numpy as np
+
+
+Vs = 3.3
+Fsamp = 96e6	# 48 MHz DDR
+Csamp = 100e-9	# 100 nF
+Rsamp = 5e3		# 5k
+
+K = Fsamp * Csamp * Rsamp # ideal value
+K = 40558 # best fit
+
+OFFSET = 200
+
+# Per-board fits of K outside this band of the best fit mean a broken RC circuit
+K_TOLERANCE = 0.25
+
+DAC_FULL_SCALE = 0x1000
+DAC_VREF = 3.3
+
+CHANNELS = 6
+
+sample_dtype = np.dtype([
+    ("ch",  np.uint8),
+    ("dac", np.uint16),
+    ("adc", np.uint32),
+])
+
+
+def Vchg(t, k=K, offset=OFFSET):
+    """ADC count(s) to voltage at the RC node, works on scalars and arrays."""
+    return Vs * (1 - np.exp(-((t + offset) / k)))
+
+
+class AdcSweep:
+    """DAC ramp samples (``CH=, DAC=, ADC=`` lines) in a typed array, filled as they arrive.
+
+    The samples can come in any order. The firmware ramps all channels at once and
+    interleaves them, so everything per channel goes by the ``ch`` field.
+    """
+    def __init__(self, capacity=256):
+        self._samples = np.zeros(capacity, dtype=sample_dtype)
+        self.count = 0
+
+    def append(self, ch, dac, adc):
+        if self.count == len(self._samples):
+            self._samples = np.resize(self._samples, 2 * len(self._samples))
+        self._samples[self.count] = (ch, dac, adc)
+        self.count += 1
+
+    @property
+    def samples(self):
+        return self._samples[:self.count]
+
+    def voltages(self, k=K, offset=OFFSET):
+        """(channel, DAC output voltage, measured voltage) arrays over all samples."""
+        s = self.samples
+        x = s["dac"] * (DAC_VREF / DAC_FULL_SCALE)
+        y = Vchg(s["adc"].astype(np.float64), k, offset) * 2 # input is through a 1/2 divider
+        return s["ch"], x, y
+
+    def fit(self):
+        """Least-squares fit of this board's K and count offset over all channels.
+
+        Inverting the charge curve gives ``adc = K * -ln(1 - V/Vs) - offset`` for the
+        known DAC voltage V, which is linear in K and offset. Points at 0V or close to
+        Vs carry no information and are left out.
+        """
+        s = self.samples
+        v = s["dac"] * (DAC_VREF / DAC_FULL_SCALE) / 2
+        m = (s["dac"] > 0) & (v < 0.95 * Vs)
+        u = -np.log1p(-v[m] / Vs)
+        t = s["adc"][m].astype(np.float64)
+
+        n = len(u)
+        su, st = u.sum(), t.sum()
+        k = (n * np.dot(u, t) - su * st) / (n * np.dot(u, u) - su * su)
+        offset = (k * su - st) / n
+        return float(k), float(offset)
+
+    def analyse(self, k=K, offset=OFFSET, channels=CHANNELS):
+        """Per channel mean relative error, gain, offset and INL, as arrays indexed by channel.
+
+        The mean relative error is taken over the non-zero points, like the original
+        pass/fail check. Gain and offset are a least-squares line through measured vs
+        DAC voltage, and INL is the worst deviation from that line in volts.
+        """
+        ch, x, y = self.voltages(k, offset)
+
+        nz = (x != 0) & (y != 0)
+        n_nz = np.bincount(ch[nz], minlength=channels)
+        rel = np.abs((x[nz] - y[nz]) / y[nz])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_error = np.bincount(ch[nz], weights=rel, minlength=channels) / n_nz
+
+            n = np.bincount(ch, minlength=channels)
+            sx = np.bincount(ch, weights=x, minlength=channels)
+            sy = np.bincount(ch, weights=y, minlength=channels)
+            sxx = np.bincount(ch, weights=x * x, minlength=channels)
+            sxy = np.bincount(ch, weights=x * y, minlength=channels)
+            gain = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+            offset_v = (sy - gain * sx) / n
+
+        inl = np.zeros(channels)
+        np.maximum.at(inl, ch, np.abs(y - (gain[ch] * x + offset_v[ch])))
+
+        return dict(mean_error=mean_error, gain=gain, offset=offset_v, inl=inl)
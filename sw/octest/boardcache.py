@@ -0,0 +1,39 @@
+# This file is part of OrangeCrab-test
+# Copyright 2020 Gregory Davill <greg.davill@gmail.com>
+
+# Small per-board store, keyed by the SPI-FLASH-UUID the firmware reports.
+# Each board gets one JSON file per kind of data, written atomically so
+# several station slots can share the same directory.
+
+import os
+import json
+import tempfile
+
+
+class BoardCache:
+    def __init__(self, root, kind):
+        self.dir = os.path.join(root, kind)
+
+    def _path(self, uuid):
+        # "e4 69 30 d3 1b 23 3b 26" -> "e46930d31b233b26"
+        return os.path.join(self.dir, "".join(uuid.split()).lower() + ".json")
+
+    def load(self, uuid):
+        try:
+            with open(self._path(uuid), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def store(self, uuid, data):
+        os.makedirs(self.dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.dir, suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp, self._path(uuid))
+
+    def remove(self, uuid):
+        try:
+            os.unlink(self._path(uuid))
+        except FileNotFoundError:
+            pass
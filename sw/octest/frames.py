@@ -0,0 +1,204 @@
+# This file is part of OrangeCrab-test
+# Copyright 2020 Gregory Davill <greg.davill@gmail.com>
+
+# Binary framing of the test firmware's measurements.
+#
+# The firmware announces "Info:frames 1" after its hello, repeating it until
+# the host answers or a few seconds have passed. If the host answers with
+# FRAMES_REQUEST it sends every measurement as a frame from then on, in
+# between the Info:/Test: text lines, FRAMES_DECLINE keeps them text:
+#
+#   SYNC | type | chan | count | count x uint32 LE | CRC-16/CCITT LE
+#
+# The CRC covers type up to the last value. Frames always start where a text
+# line would, and SYNC is not ASCII, so the two never get mixed up. A frame
+# that fails its CRC is reported as a FrameError in the output, and decoding
+# carries on after it.
+#
+# Benchmark against the text protocol, over a captured log:
+#   python3 -m octest.frames log/PASS-2020-07-06-12:02:02.txt
+
+import struct
+import argparse
+import binascii
+
+from time import perf_counter
+
+
+SYNC = 0xa5
+FRAMES_REQUEST = b"F"
+FRAMES_DECLINE = b"T"
+
+# type, chan, count
+HEADER = struct.Struct("<BBB")
+CRC = struct.Struct("<H")
+
+FRAME_DAC_ADC = 1   # chan = DAC channel, values = DAC code, ADC result
+FRAME_ADC = 2       # chan = ADC mux channel, values = ADC result
+
+# ADC mux channels the firmware measures through FRAME_ADC
+ADC_CHANNELS = {0: "GND", 7: "VREF", 8: "3V3", 12: "1V35", 13: "2V5", 14: "1V1", 15: "VBAT"}
+ADC_CHANNEL_IDS = {name: chan for chan, name in ADC_CHANNELS.items()}
+
+_values = [struct.Struct(f"<{n}I") for n in range(256)]
+
+
+class FrameError(ValueError):
+    pass
+
+
+class Frame:
+    __slots__ = ("type", "chan", "values")
+
+    def __init__(self, type, chan, values):
+        self.type = type
+        self.chan = chan
+        self.values = values
+
+    def text(self):
+        """The line the firmware prints for this measurement in text mode."""
+        if self.type == FRAME_DAC_ADC:
+            return f"CH={self.chan}, DAC={self.values[0]}, ADC={self.values[1]}"
+        if self.type == FRAME_ADC:
+            return f"ADC-{ADC_CHANNELS.get(self.chan, self.chan)}={self.values[0]}"
+        return f"Frame:{self.type} {self.chan} {self.values}"
+
+    def __repr__(self):
+        return f"Frame({self.type}, {self.chan}, {self.values})"
+
+
+def crc16(data):
+    return binascii.crc_hqx(data, 0xffff)
+
+
+def encode(type, chan, values):
+    body = HEADER.pack(type, chan, len(values)) + _values[len(values)].pack(*values)
+    return bytes([SYNC]) + body + CRC.pack(crc16(body))
+
+
+class FrameDecoder:
+    """Splits the bytes from the DUT into text lines (str) and Frames.
+
+    Data is decoded in place through a memoryview of the receive buffer, the
+    only copies are the text lines and the values of each frame. A CRC error
+    gives a FrameError in place of the frame and skips it whole, by the length
+    in its header, so none of its bytes end up in front of the next line.
+    """
+    def __init__(self):
+        self.buf = bytearray()
+        self.frames = 0
+        self.errors = 0
+
+    def feed(self, data):
+        """Add received bytes, returns the lines and frames completed by them."""
+        buf = self.buf
+        buf += data
+        out = []
+        pos = 0
+        end = len(buf)
+        with memoryview(buf) as view:
+            while pos < end:
+                if buf[pos] == SYNC:
+                    if end - pos < 1 + HEADER.size:
+                        break
+                    type, chan, count = HEADER.unpack_from(view, pos + 1)
+                    crc_pos = pos + 1 + HEADER.size + 4 * count
+                    if crc_pos + CRC.size > end:
+                        break
+                    if crc16(view[pos + 1:crc_pos]) != CRC.unpack_from(view, crc_pos)[0]:
+                        out.append(FrameError(f"CRC error in frame {bytes(view[pos:crc_pos + CRC.size]).hex()}"))
+                        self.errors += 1
+                        pos = crc_pos + CRC.size
+                        continue
+                    out.append(Frame(type, chan, _values[count].unpack_from(view, pos + 1 + HEADER.size)))
+                    self.frames += 1
+                    pos = crc_pos + CRC.size
+                else:
+                    eol = buf.find(b"\n", pos)
+                    if eol < 0:
+                        break
+                    # Bytes of a damaged frame can end up here, they mustn't stop the decoder
+                    line = str(view[pos:eol], "ascii", "replace").strip("\r")
+                    if line:
+                        out.append(line)
+                    pos = eol + 1
+        del buf[:pos]
+        return out
+
+
+# Benchmark --------------------------------------------------------------------------------------
+
+def _text_measurement(line):
+    """ProcessLines' parsing of the measurement lines, before frames."""
+    if "CH=" in line:
+        d = dict(map(lambda x: x.split('='), line.split(', ')))
+        return int(d['CH']), int(d['DAC']), int(d['ADC'])
+    if "ADC" in line:
+        try:
+            return line.split('=')[0].split('-')[1], int(line.split('=')[1])
+        except:
+            ...
+    return None
+
+
+def to_frames(lines):
+    """The byte stream the firmware sends for these text lines with frames on."""
+    out = bytearray()
+    for line in lines:
+        if line.startswith("CH="):
+            d = dict(x.split('=') for x in line.split(', '))
+            out += encode(FRAME_DAC_ADC, int(d['CH']), (int(d['DAC']), int(d['ADC'])))
+        elif line.startswith("ADC-") and line[4:].split('=')[0] in ADC_CHANNEL_IDS:
+            rail, value = line[4:].split('=')
+            out += encode(FRAME_ADC, ADC_CHANNEL_IDS[rail], (int(value),))
+        else:
+            out += (line + '\r\n').encode('ascii')
+    return bytes(out)
+
+
+def bench(lines, chunk=512):
+    text = "".join(l + '\r\n' for l in lines).encode('ascii')
+    framed = to_frames(lines)
+
+    def chunks(data):
+        return [data[i:i + chunk] for i in range(0, len(data), chunk)]
+
+    # Both are received in USB packet sized chunks and split up the same way
+    start = perf_counter()
+    decoder = FrameDecoder()
+    measurements = 0
+    for data in chunks(text):
+        for line in decoder.feed(data):
+            if _text_measurement(line) is not None:
+                measurements += 1
+    t_text = perf_counter() - start
+
+    start = perf_counter()
+    decoder = FrameDecoder()
+    frames = 0
+    for data in chunks(framed):
+        for item in decoder.feed(data):
+            if type(item) is Frame:
+                frames += 1
+    t_frames = perf_counter() - start
+
+    print(f"measurements: {measurements} text, {frames} frames")
+    print(f"wire bytes:   {len(text)} text, {len(framed)} framed ({len(framed) / len(text):.0%})")
+    print(f"host decode:  {t_text * 1e3:.1f} ms text, {t_frames * 1e3:.1f} ms framed "
+          f"({t_text / t_frames:.1f}x)")
+
+
+def main():
+    from .serial_pipeline import read_serial_log
+
+    parser = argparse.ArgumentParser(description="Compare the framed measurement protocol with the text one over a captured log")
+    parser.add_argument("log", help="log file written by OrangeCrab-tests.py, or a plain serial capture")
+    parser.add_argument("--repeat", type=int, default=100,
+                        help="number of times to replay the log (default=100)")
+    args = parser.parse_args()
+
+    bench(read_serial_log(args.log) * args.repeat)
+
+
+if __name__ == "__main__":
+    main()
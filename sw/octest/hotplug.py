@@ -0,0 +1,186 @@
+# This file is part of OrangeCrab-test
+# Copyright 2020 Gregory Davill <greg.davill@gmail.com>
+
+# USB hotplug watcher for the DUT.
+#
+# Devices are tracked from uevents, and waiters are released as soon as a
+# matching device (and for CDC, its tty) shows up. Events come from udev over
+# netlink when pyudev is installed. Without it there are no events to wait on:
+# /sys/bus/usb/devices is rescanned every poll_interval (no subprocess, no bus
+# scan, but still polling), so install pyudev to get rid of the polling.
+# Tests can feed synthetic uevents through HotplugWatcher.inject().
+
+import os
+import re
+import glob
+import threading
+
+from collections import namedtuple
+
+
+UDEV_RULES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "..", "..", "udev-rules", "10-orangecrab-test.rules")
+
+SYSFS_USB = "/sys/bus/usb/devices"
+
+UsbDevice = namedtuple("UsbDevice", ["vid", "pid", "path", "tty"])
+
+# USB topology path of a device, e.g. "1-1.2" (interfaces look like "1-1.2:1.0")
+_usb_path_re = re.compile(r"^\d+-[\d.]+$")
+
+
+def udev_ids(filename=UDEV_RULES):
+    """VID:PID pairs granted access in the udev rules."""
+    ids = set()
+    with open(filename, 'r') as f:
+        for vid, pid in re.findall(r'ATTRS\{idVendor\}=="(\w+)",\s*ATTRS\{idProduct\}=="(\w+)"', f.read()):
+            ids.add((int(vid, 16), int(pid, 16)))
+    return ids
+
+
+def _usb_path(devpath):
+    # deepest component of DEVPATH that names a USB device
+    path = None
+    for part in devpath.split('/'):
+        if _usb_path_re.match(part):
+            path = part
+    return path
+
+
+class HotplugWatcher:
+    """Tracks the DUT's USB devices and ttys from uevents.
+
+    The udev source is event driven. The sysfs fallback, used when pyudev is
+    missing, polls sysfs every ``poll_interval`` seconds and turns the
+    differences into uevents, so it reacts up to that late.
+    """
+    def __init__(self, ids=None, poll_interval=0.05):
+        self.ids = udev_ids() if ids is None else set(ids)
+        self.poll_interval = poll_interval
+
+        self._devices = {}   # usb path -> (vid, pid)
+        self._ttys = {}      # usb path -> tty device node
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Events -----------------------------------------------------------------------------------
+
+    def inject(self, uevent):
+        """Handle one uevent, given as a dict of its properties (ACTION, SUBSYSTEM, DEVPATH, ...)."""
+        action = uevent.get("ACTION")
+        subsystem = uevent.get("SUBSYSTEM")
+        path = _usb_path(uevent.get("DEVPATH", ""))
+        if path is None:
+            return
+
+        with self._cond:
+            if subsystem == "usb" and uevent.get("DEVTYPE") == "usb_device":
+                if action == "add":
+                    # PRODUCT is "<vid>/<pid>/<bcdDevice>" in hex
+                    vid, pid = (int(x, 16) for x in uevent["PRODUCT"].split('/')[:2])
+                    if (vid, pid) in self.ids:
+                        self._devices[path] = (vid, pid)
+                elif action == "remove":
+                    self._devices.pop(path, None)
+                    self._ttys.pop(path, None)
+            elif subsystem == "tty":
+                if action == "add":
+                    devname = uevent["DEVNAME"]
+                    if not devname.startswith("/dev/"):
+                        devname = "/dev/" + devname
+                    self._ttys[path] = devname
+                elif action == "remove":
+                    self._ttys.pop(path, None)
+            self._cond.notify_all()
+
+    def _find(self, vid, pid, path, tty):
+        for p, ids in self._devices.items():
+            if ids != (vid, pid) or (path is not None and p != path):
+                continue
+            if tty and p not in self._ttys:
+                continue
+            return UsbDevice(vid, pid, p, self._ttys.get(p))
+        return None
+
+    def wait_for(self, vid, pid, path=None, tty=False, timeout=None):
+        """Block until a vid:pid device is present (on ``path`` if given, with a tty if ``tty``).
+
+        Returns a UsbDevice, or None on timeout.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._find(vid, pid, path, tty), timeout)
+            return self._find(vid, pid, path, tty)
+
+    # Sources ----------------------------------------------------------------------------------
+
+    def start(self):
+        try:
+            import pyudev
+            target = self._run_udev
+        except ImportError:
+            if not os.path.isdir(SYSFS_USB):
+                raise OSError("hotplug: neither pyudev nor sysfs is available")
+            target = self._run_sysfs
+        self._thread = threading.Thread(target=target, name="hotplug", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run_udev(self):
+        import pyudev
+        context = pyudev.Context()
+        monitor = pyudev.Monitor.from_netlink(context)
+        monitor.filter_by("usb", device_type="usb_device")
+        monitor.filter_by("tty")
+        monitor.start()
+
+        # Devices already attached before the monitor started
+        for subsystem in ("usb", "tty"):
+            for device in context.list_devices(subsystem=subsystem):
+                self.inject(dict(device.properties, ACTION="add"))
+
+        while not self._stop.is_set():
+            device = monitor.poll(timeout=0.5)
+            if device is not None:
+                self.inject(dict(device.properties, ACTION=device.action))
+
+    def _sysfs_snapshot(self):
+        devices = {}
+        for entry in os.listdir(SYSFS_USB):
+            if not _usb_path_re.match(entry):
+                continue
+            try:
+                with open(os.path.join(SYSFS_USB, entry, "idVendor")) as f:
+                    vid = f.read().strip()
+                with open(os.path.join(SYSFS_USB, entry, "idProduct")) as f:
+                    pid = f.read().strip()
+            except OSError:
+                continue # removed while we were looking
+            ttys = glob.glob(os.path.join(SYSFS_USB, entry + ":*", "tty", "tty*"))
+            devices[entry] = (vid, pid, os.path.basename(ttys[0]) if ttys else None)
+        return devices
+
+    def _run_sysfs(self):
+        known = {}
+        while not self._stop.is_set():
+            current = self._sysfs_snapshot()
+            for path, (vid, pid, tty) in known.items():
+                if current.get(path) != (vid, pid, tty):
+                    if tty is not None:
+                        self.inject(dict(ACTION="remove", SUBSYSTEM="tty", DEVPATH=f"/{path}/{path}:1.0/tty/{tty}"))
+                    if path not in current or current[path][:2] != (vid, pid):
+                        self.inject(dict(ACTION="remove", SUBSYSTEM="usb", DEVTYPE="usb_device", DEVPATH=f"/{path}"))
+            for path, (vid, pid, tty) in current.items():
+                if known.get(path) != (vid, pid, tty):
+                    self.inject(dict(ACTION="add", SUBSYSTEM="usb", DEVTYPE="usb_device", DEVPATH=f"/{path}",
+                                     PRODUCT=f"{vid}/{pid}/0"))
+                    if tty is not None:
+                        self.inject(dict(ACTION="add", SUBSYSTEM="tty", DEVPATH=f"/{path}/{path}:1.0/tty/{tty}",
+                                         DEVNAME=tty))
+            known = current
+            self._stop.wait(self.poll_interval)
@@ -0,0 +1,175 @@
+# This file is part of OrangeCrab-test
+# Copyright 2020 Gregory Davill <greg.davill@gmail.com>
+
+# Classifier for the lines the test firmware prints.
+#
+# classify() looks at the first three characters of a line once, and hands it
+# to the parser for that kind of message, which returns a record for it. Lines
+# of no interest to the host (progress messages and such) give None.
+#
+# Benchmark against the substring checks it replaces, over a corpus of
+# captured serial logs:
+#   python3 -m octest.lines log/PASS-*.txt --lines 1000000
+
+import re
+import argparse
+
+from time import perf_counter
+
+
+class Info:
+    """ "Info:<text>", key is the text up to the first space or '='. """
+    __slots__ = ("text", "key", "value")
+
+    def __init__(self, text, key, value):
+        self.text = text
+        self.key = key
+        self.value = value
+
+
+class Test:
+    """ "Test:<name>|Pass", "Test:<name>, Start", ... """
+    __slots__ = ("line", "name", "passed", "failed", "started")
+
+    def __init__(self, line, name, passed, failed, started):
+        self.line = line
+        self.name = name
+        self.passed = passed
+        self.failed = failed
+        self.started = started
+
+
+class DacAdc:
+    """ "CH=<dac channel>, DAC=<code>, ADC=<result>" """
+    __slots__ = ("chan", "dac", "adc")
+
+    def __init__(self, chan, dac, adc):
+        self.chan = chan
+        self.dac = dac
+        self.adc = adc
+
+
+class Rail:
+    """ "ADC-<rail>=<result>" """
+    __slots__ = ("rail", "adc")
+
+    def __init__(self, rail, adc):
+        self.rail = rail
+        self.adc = adc
+
+
+class Malformed:
+    """A measurement line that doesn't parse."""
+    __slots__ = ("line",)
+
+    def __init__(self, line):
+        self.line = line
+
+
+_info = re.compile(r"Info:(([^ =]*)[ =]?(.*))")
+_dac_adc = re.compile(r"CH=(\d+), DAC=(\d+), ADC=(\d+)$")
+_rail = re.compile(r"ADC-(\w+)=(\d+)$")
+
+
+def _parse_info(line):
+    m = _info.match(line)
+    return Info(m[1], m[2], m[3].strip())
+
+
+def _parse_test(line):
+    if not line.startswith("Test:"):
+        return None
+    lower = line.lower()
+    return Test(line, line[5:].split('|')[0], 'pass' in lower, 'failed' in lower, 'started' in lower)
+
+
+def _parse_dac_adc(line):
+    m = _dac_adc.match(line)
+    if m is None:
+        return Malformed(line)
+    return DacAdc(int(m[1]), int(m[2]), int(m[3]))
+
+
+def _parse_rail(line):
+    if not line.startswith("ADC-"):
+        return None
+    m = _rail.match(line)
+    if m is None:
+        return Malformed(line)
+    return Rail(m[1], int(m[2]))
+
+
+PARSERS = {
+    "Inf": _parse_info,
+    "Tes": _parse_test,
+    "CH=": _parse_dac_adc,
+    "ADC": _parse_rail,
+}
+
+
+def classify(line):
+    """Record for a line from the firmware, None if it carries nothing for the host."""
+    parser = PARSERS.get(line[:3])
+    return parser(line) if parser is not None else None
+
+
+# Benchmark --------------------------------------------------------------------------------------
+
+def _substring_classify(line):
+    """What ProcessLines did for every line before classify(), without acting on it."""
+    out = None
+    if line.startswith("Info:"):
+        out = line[5:]
+        if line.startswith("Info:SPI-FLASH-UUID="):
+            out = line.split('=')[1].strip()
+        for key in ("test-repo", "migen", "litex"):
+            if line.startswith(f"Info:{key} "):
+                out = line.split()[1]
+    if line.startswith("Test:"):
+        out = ('pass' in line.lower(), 'failed' in line.lower(), 'started' in line.lower(),
+               line[5:].split('|')[0])
+    if "CH=" in line:
+        d = dict(map(lambda x: x.split('='), line.split(', ')))
+        out = int(d['CH']), int(d['DAC']), int(d['ADC'])
+    if "ADC" in line:
+        try:
+            out = int(line.split('=')[1]), line.split('=')[0].split('-')[1]
+        except:
+            ...
+    if "Test:ADC, Finish" in line or "Test:BATT, Finish" in line:
+        out = line
+    return out
+
+
+def bench(corpus):
+    for name, f in (("substring", _substring_classify), ("classify", classify)):
+        start = perf_counter()
+        for line in corpus:
+            f(line)
+        elapsed = perf_counter() - start
+        print(f"{name:10s} {elapsed * 1e3:8.1f} ms  {len(corpus) / elapsed / 1e6:6.2f} M lines/s")
+
+
+def main():
+    from .serial_pipeline import read_serial_log
+
+    parser = argparse.ArgumentParser(description="Time classify() against the old substring checks over captured serial logs")
+    parser.add_argument("logs", nargs="+", help="log files written by OrangeCrab-tests.py, or plain serial captures")
+    parser.add_argument("--lines", type=int, default=1000000,
+                        help="size of the corpus, the logs are repeated up to it (default=1000000)")
+    args = parser.parse_args()
+
+    lines = [l for log in args.logs for l in read_serial_log(log)]
+    corpus = (lines * (args.lines // len(lines) + 1))[:args.lines]
+
+    kinds = {}
+    for line in lines:
+        kind = type(classify(line)).__name__
+        kinds[kind] = kinds.get(kind, 0) + 1
+    print(f"{len(lines)} lines captured, {', '.join(f'{n} {k}' for k, n in sorted(kinds.items()))}")
+    print(f"corpus of {len(corpus)} lines")
+    bench(corpus)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+# This file is part of OrangeCrab-test
+# Copyright 2020 Gregory Davill <greg.davill@gmail.com>
+
+# Results database, one row per board run plus its verdicts, measurements and
+# stage timings, in SQLite (WAL mode so station slots can share one file).
+#
+# Runs are handed to a writer thread and inserted in batches, the test flow
+# never waits on the disk. Query it with:
+#   python3 -m octest.results yield --last 10000
+#   python3 -m octest.results dist "ADC 1V1"
+
+import os
+import sys
+import queue
+import sqlite3
+import argparse
+import threading
+
+from time import time, monotonic
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id          INTEGER PRIMARY KEY,
+    started     REAL,
+    finished    REAL,
+    slot        TEXT,
+    result      TEXT,
+    flash_uuid  TEXT,
+    repo_sha    TEXT,
+    migen_sha   TEXT,
+    litex_sha   TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_uuid     ON runs(flash_uuid);
+CREATE INDEX IF NOT EXISTS runs_result   ON runs(result);
+CREATE INDEX IF NOT EXISTS runs_finished ON runs(finished);
+CREATE INDEX IF NOT EXISTS runs_repo_sha ON runs(repo_sha);
+
+CREATE TABLE IF NOT EXISTS verdicts (
+    run_id      INTEGER REFERENCES runs(id),
+    test        TEXT,
+    result      TEXT
+);
+CREATE INDEX IF NOT EXISTS verdicts_test ON verdicts(test, result);
+CREATE INDEX IF NOT EXISTS verdicts_run  ON verdicts(run_id);
+
+CREATE TABLE IF NOT EXISTS measurements (
+    run_id      INTEGER REFERENCES runs(id),
+    name        TEXT,
+    value       REAL
+);
+CREATE INDEX IF NOT EXISTS measurements_name ON measurements(name, value);
+CREATE INDEX IF NOT EXISTS measurements_run  ON measurements(run_id);
+
+CREATE TABLE IF NOT EXISTS stages (
+    run_id      INTEGER REFERENCES runs(id),
+    stage       TEXT,
+    wait        REAL,
+    duration    REAL
+);
+CREATE INDEX IF NOT EXISTS stages_stage ON stages(stage, duration);
+"""
+
+
+class RunRecord:
+    def __init__(self, slot=None):
+        self.started = time()
+        self.finished = None
+        self.slot = slot
+        self.result = None
+        self.flash_uuid = None
+        self.repo_sha = None
+        self.migen_sha = None
+        self.litex_sha = None
+
+        self.verdicts = []      # (test, "OK"/"FAIL")
+        self.measurements = []  # (name, value)
+        self.stages = []        # (stage, wait, duration)
+
+
+def connect(filename):
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    conn = sqlite3.connect(filename, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def insert_runs(conn, runs):
+    with conn:
+        for r in runs:
+            cur = conn.execute(
+                "INSERT INTO runs (started, finished, slot, result, flash_uuid, repo_sha, migen_sha, litex_sha) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (r.started, r.finished, r.slot, r.result, r.flash_uuid, r.repo_sha, r.migen_sha, r.litex_sha))
+            run_id = cur.lastrowid
+            conn.executemany("INSERT INTO verdicts VALUES (?, ?, ?)",
+                             [(run_id, t, v) for t, v in r.verdicts])
+            conn.executemany("INSERT INTO measurements VALUES (?, ?, ?)",
+                             [(run_id, n, v) for n, v in r.measurements])
+            conn.executemany("INSERT INTO stages VALUES (?, ?, ?, ?)",
+                             [(run_id, s, w, d) for s, w, d in r.stages])
+
+
+class ResultsStore:
+    """Append-only store, inserts happen in batches on a writer thread."""
+    def __init__(self, filename, batch=64, interval=1.0):
+        self.filename = filename
+        self.batch = batch
+        self.interval = interval
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="results", daemon=True)
+        self._thread.start()
+
+    def add(self, run):
+        self._queue.put(run)
+
+    def close(self):
+        """Write out everything queued so far and stop the writer."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        conn = connect(self.filename)
+        done = False
+        while not done:
+            pending = [self._queue.get()]
+            deadline = monotonic() + self.interval
+            while len(pending) < self.batch and pending[-1] is not None:
+                try:
+                    pending.append(self._queue.get(timeout=max(0, deadline - monotonic())))
+                except queue.Empty:
+                    break
+            if pending[-1] is None:
+                pending.pop()
+                done = True
+            if pending:
+                insert_runs(conn, pending)
+        conn.close()
+
+
+# Queries ------------------------------------------------------------------------------------------
+
+def yield_report(conn, last=None):
+    runs = "SELECT id, result FROM runs ORDER BY id DESC"
+    if last is not None:
+        runs += f" LIMIT {int(last)}"
+
+    total, passed = conn.execute(
+        f"SELECT count(*), coalesce(sum(result = 'PASS'), 0) FROM ({runs})").fetchone()
+    lines = [f"runs: {total}, pass: {passed}, yield: {passed / total:.2%}" if total else "runs: 0"]
+
+    # Which test stopped each failing run
+    rows = conn.execute(
+        f"SELECT v.test, count(*) FROM ({runs}) r JOIN verdicts v ON v.run_id = r.id "
+        f"WHERE v.result = 'FAIL' GROUP BY v.test ORDER BY count(*) DESC").fetchall()
+    for test, count in rows:
+        lines.append(f"  {test:20s}{count:8d} FAIL")
+    return lines
+
+
+def distribution(conn, name, bins=20, last=None):
+    where = "name = ?"
+    args = [name]
+    if last is not None:
+        # ids are handed out in order and never reused
+        where += " AND run_id > (SELECT coalesce(max(id), 0) - ? FROM runs)"
+        args.append(int(last))
+
+    lo, hi, count, mean = conn.execute(
+        f"SELECT min(value), max(value), count(*), avg(value) FROM measurements WHERE {where}", args).fetchone()
+    if not count:
+        return [f"{name}: no data"]
+
+    width = (hi - lo) / bins or 1
+    rows = conn.execute(
+        f"SELECT min(CAST((value - ?) / ? AS INTEGER), {bins - 1}) AS b, count(*) "
+        f"FROM measurements WHERE {where} GROUP BY b ORDER BY b", [lo, width] + args).fetchall()
+
+    lines = [f"{name}: n={count}, mean={mean:.4f}, min={lo:.4f}, max={hi:.4f}"]
+    peak = max(c for _, c in rows)
+    for b, c in rows:
+        lines.append(f"  {lo + b * width:10.4f} {c:8d} " + "#" * max(1, 50 * c // peak))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the OrangeCrab test results database")
+    parser.add_argument("--db", default=os.path.join("log", "results.db"),
+                        help="results database (default=log/results.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("yield", help="pass rate, and which tests failed")
+    p.add_argument("--last", type=int, default=None, help="only the last N runs")
+
+    p = sub.add_parser("dist", help="histogram of a measurement, e.g. \"ADC 1V1\"")
+    p.add_argument("name")
+    p.add_argument("--bins", type=int, default=20)
+    p.add_argument("--last", type=int, default=None, help="only the last N runs")
+
+    sub.add_parser("names", help="list the recorded measurements")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        sys.exit(f"{args.db}: no such database")
+    conn = connect(args.db)
+
+    if args.command == "yield":
+        lines = yield_report(conn, args.last)
+    elif args.command == "dist":
+        lines = distribution(conn, args.name, args.bins, args.last)
+    else:
+        lines = [n for (n,) in conn.execute("SELECT DISTINCT name FROM measurements ORDER BY name")]
+
+    for l in lines:
+        print(l)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# This file is part of OrangeCrab-test
+# Copyright 2020 Gregory Davill <greg.davill@gmail.com>
+
+# Run log streamed to disk as the test goes, instead of held in memory until
+# the verdict. The test output and the raw serial log are written to their own
+# ".part" files while the run is in progress, so a crash or a hung DUT still
+# leaves everything up to the last sync on disk. At the end the serial log is
+# appended behind the RAW marker and the file is renamed to PASS-/FAIL-<time>.txt
+# in one step, the same layout as before.
+#
+# Optionally gzip or zstd compressed (zstd needs the `zstandard` package), and
+# with the raw serial log rotated in segments of max_bytes, keeping the newest
+# `keep` of them, for long soak runs.
+
+import os
+import io
+import gzip
+import shutil
+
+from time import monotonic, localtime, strftime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+RAW_LOG_MARKER = "-=-=-=-=-= RAW serial log -=-=-=-=-=-="
+
+SUFFIX = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def _compress(compress, data):
+    if compress == "gzip":
+        return gzip.compress(data)
+    if compress == "zstd":
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+class LogStream:
+    """Line writer that hands every line to the OS and fsyncs in batches."""
+    def __init__(self, filename, compress=None, sync_interval=1.0, sync_lines=256):
+        self.filename = filename
+        self.compress = compress
+        self.sync_interval = sync_interval
+        self.sync_lines = sync_lines
+
+        self.bytes = 0
+        self._pending = 0
+        self._last_sync = monotonic()
+
+        self._raw = open(filename, "wb")
+        if compress == "gzip":
+            self._f = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=6)
+        elif compress == "zstd":
+            self._f = zstandard.ZstdCompressor().stream_writer(self._raw, closefd=False)
+        else:
+            self._f = self._raw
+
+    def write(self, line):
+        data = (line + "\n").encode("utf-8", errors="replace")
+        self._f.write(data)
+        self.bytes += len(data)
+        self._pending += 1
+
+        if self.compress is None:
+            self._f.flush()
+        # A compressor flush per line would cost most of the compression, so those wait for the sync
+        if self._pending >= self.sync_lines or monotonic() - self._last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        self._f.flush()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._pending = 0
+        self._last_sync = monotonic()
+
+    def close(self):
+        if self._f is not self._raw:
+            self._f.close()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+
+
+class RunLog:
+    def __init__(self, log_dir, compress=None, max_bytes=None, keep=4, sync_interval=1.0, sync_lines=256):
+        if compress not in SUFFIX:
+            raise ValueError(f"unknown compression '{compress}'")
+        if compress == "zstd" and zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+
+        os.makedirs(log_dir, exist_ok=True)
+        self.log_dir = log_dir
+        self.compress = compress
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self._options = dict(compress=compress, sync_interval=sync_interval, sync_lines=sync_lines)
+
+        start = strftime("%Y-%m-%d-%H:%M:%S", localtime())
+        self.prefix = os.path.join(log_dir, f"run-{start}-{os.getpid()}")
+        self.filename = None
+
+        self._output = LogStream(f"{self.prefix}.txt{SUFFIX[compress]}.part", **self._options)
+        self._segments = []
+        self._dropped = 0
+        self._next = 0
+        self._serial = None
+        self._new_segment()
+
+    def _new_segment(self):
+        if self._serial is not None:
+            self._serial.close()
+        self._serial = LogStream(f"{self.prefix}.serial.{self._next}{SUFFIX[self.compress]}.part", **self._options)
+        self._segments.append(self._serial)
+        self._next += 1
+
+        while self.keep is not None and len(self._segments) > self.keep:
+            old = self._segments.pop(0)
+            self._dropped += old.bytes
+            os.remove(old.filename)
+
+    def output(self, line):
+        self._output.write(line)
+
+    def serial(self, line):
+        self._serial.write(line)
+        if self.max_bytes is not None and self._serial.bytes >= self.max_bytes:
+            self._new_segment()
+
+    def close(self, name):
+        """Put the log together as <name>.txt and return its filename. Only the first call counts."""
+        if self.filename is not None:
+            return self.filename
+
+        self._output.close()
+        self._serial.close()
+
+        header = "\r\n" + RAW_LOG_MARKER + "\r\n"
+        if self._dropped:
+            header += f"({self._dropped} bytes of older serial log rotated out)\n"
+
+        part = self._output.filename
+        with open(part, "ab") as f:
+            # gzip members and zstd frames read back as one stream when concatenated
+            f.write(_compress(self.compress, header.encode("ascii")))
+            for s in self._segments:
+                with open(s.filename, "rb") as seg:
+                    shutil.copyfileobj(seg, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.filename = os.path.join(self.log_dir, f"{name}.txt{SUFFIX[self.compress]}")
+        os.replace(part, self.filename)
+        for s in self._segments:
+            os.remove(s.filename)
+        return self.filename
+
+
+def open_log(filename):
+    """Open a run log for reading as text, whatever it was compressed with."""
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "rt", errors="replace")
+    if filename.endswith(".zst"):
+        if zstandard is None:
+            raise ValueError("reading zstd logs needs the zstandard package")
+        raw = open(filename, "rb")
+        reader = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+        return io.TextIOWrapper(reader, errors="replace")
+    return open(filename, "r", errors="replace")
@@ -0,0 +1,272 @@
+# This file is part of OrangeCrab-test
+# Copyright 2020 Gregory Davill <greg.davill@gmail.com>
+
+# Event driven line reader for the DUT CDC-ACM port.
+#
+# A producer task waits on the serial fd through an asyncio StreamReader and
+# pushes (rx time, line) records into a bounded queue. A separate consumer
+# task hands them to the line handler (ProcessLines), so the host never polls
+# the port and slow processing does not stall reception.
+#
+# With a frame handler the stream may also carry binary measurement frames
+# (see frames.py), which go to that handler instead, as Frame objects.
+#
+# Where the event loop cannot watch the port (pyserial on Windows has no
+# selectable fd) a thread blocks in port.read() and feeds the StreamReader.
+#
+# Benchmark, replaying a captured log through a pty:
+#   python3 -m octest.serial_pipeline log/PASS-2020-07-06-12:02:02.txt
+
+import asyncio
+import os
+import sys
+import argparse
+import statistics
+import threading
+
+try:
+    import termios
+except ImportError:
+    termios = None  # Windows
+
+from collections import namedtuple
+from time import monotonic
+
+from .runlog import RAW_LOG_MARKER, open_log
+from .frames import FrameDecoder, FrameError
+
+
+Record = namedtuple("Record", ["t_rx", "line"])
+
+
+def _fileno(port):
+    """The fd of ``port`` if the event loop can watch it, else None."""
+    if termios is None:
+        return None
+    try:
+        return port.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+class _ThreadReader:
+    """Feed a StreamReader from a thread reading ``port``, closed like a transport."""
+    def __init__(self, port, reader, loop):
+        self._port = port
+        self._loop = loop
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(reader,), daemon=True)
+        self._thread.start()
+
+    def _call(self, fn, *args):
+        if self._stop.is_set():
+            return
+        try:
+            self._loop.call_soon_threadsafe(fn, *args)
+        except RuntimeError:
+            pass    # loop already closed
+
+    def _run(self, reader):
+        try:
+            while not self._stop.is_set():
+                data = self._port.read(max(1, getattr(self._port, "in_waiting", 0)))
+                if data:
+                    self._call(reader.feed_data, data)
+        except Exception as e:
+            self._call(reader.set_exception, e)
+        else:
+            self._call(reader.feed_eof)
+
+    def close(self):
+        self._stop.set()
+        cancel_read = getattr(self._port, "cancel_read", None)
+        if cancel_read is not None:
+            cancel_read()
+
+
+async def open_line_reader(port, limit=2**16):
+    """Attach an open serial port to a StreamReader.
+
+    Ports with a ``fileno()`` are watched by the event loop, anything else
+    only needs ``read()``, which is then called from a thread.
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=limit, loop=loop)
+
+    fd = _fileno(port)
+    if fd is None:
+        return reader, _ThreadReader(port, reader, loop)
+
+    # pyserial leaves VMIN=0, where a read with nothing pending returns 0 bytes,
+    # which the event loop would take as EOF. Block for at least one byte instead.
+    if os.isatty(fd):
+        attr = termios.tcgetattr(fd)
+        attr[6][termios.VMIN] = 1
+        attr[6][termios.VTIME] = 0
+        termios.tcsetattr(fd, termios.TCSANOW, attr)
+
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader, loop=loop), port)
+    return reader, transport
+
+
+class LinePipeline:
+    """Read lines from ``port`` and call ``handler(line)`` for each one.
+
+    Stops after a line containing ``until`` has been handled, or at EOF.
+    Frames go to ``frame_handler(frame)``, when one is given, and so do the
+    FrameErrors of frames that failed their CRC.
+    """
+    def __init__(self, handler, until=None, maxsize=1024, frame_handler=None):
+        self.handler = handler
+        self.until = until
+        self.maxsize = maxsize
+        self.frame_handler = frame_handler
+
+        self.lines = 0
+        self.frames = 0
+        self.frame_errors = 0
+        self.t_rx = None    # receive time of the line being handled
+        self._port = None
+        self._fd = None
+
+    def write(self, data):
+        """Send data to the DUT, from the handlers while run() is going."""
+        if self._fd is None:
+            self._port.write(data)
+            return
+        while data:
+            data = data[os.write(self._fd, data):]
+
+    async def _produce(self, reader, queue):
+        try:
+            while True:
+                data = await reader.readline()
+                if not data:
+                    break
+                line = data.decode(encoding='ascii').strip("\n\r")
+                if line:
+                    await queue.put(Record(monotonic(), line))
+                    if self.until is not None and self.until in line:
+                        break
+        finally:
+            await queue.put(None)
+
+    async def _produce_frames(self, reader, queue):
+        decoder = FrameDecoder()
+        try:
+            while True:
+                data = await reader.read(2**16)
+                if not data:
+                    break
+                t_rx = monotonic()
+                for item in decoder.feed(data):
+                    await queue.put(Record(t_rx, item))
+                    if self.until is not None and type(item) is str and self.until in item:
+                        return
+        finally:
+            await queue.put(None)
+
+    async def _consume(self, queue):
+        while True:
+            record = await queue.get()
+            if record is None:
+                return
+            self.t_rx = record.t_rx
+            if type(record.line) is str:
+                self.lines += 1
+                self.handler(record.line)
+            else:
+                if type(record.line) is FrameError:
+                    self.frame_errors += 1
+                else:
+                    self.frames += 1
+                self.frame_handler(record.line)
+
+    async def run(self, port):
+        self._port = port
+        self._fd = _fileno(port)
+        reader, transport = await open_line_reader(port)
+        queue = asyncio.Queue(self.maxsize)
+
+        produce = self._produce if self.frame_handler is None else self._produce_frames
+        producer = asyncio.ensure_future(produce(reader, queue))
+        consumer = asyncio.ensure_future(self._consume(queue))
+        try:
+            done, _ = await asyncio.wait([producer, consumer], return_when=asyncio.FIRST_EXCEPTION)
+            if consumer not in done:
+                # Producer has stopped and queued the sentinel, drain what is left
+                await consumer
+        finally:
+            producer.cancel()
+            consumer.cancel()
+            transport.close()
+
+        # Surface handler errors first, then read errors (e.g. device disconnect)
+        for task in (consumer, producer):
+            if not task.cancelled():
+                task.result()
+
+
+def read_serial_log(filename):
+    with open_log(filename) as f:
+        lines = f.read().splitlines()
+    if RAW_LOG_MARKER in lines:
+        lines = lines[lines.index(RAW_LOG_MARKER) + 1:]
+    return [l for l in lines if l]
+
+
+def bench(lines):
+    import pty
+    import tty
+
+    end_marker = "-- bench end --"
+    lines = lines + [end_marker]
+
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+
+    written = [0.0] * len(lines)
+    handled = []
+
+    def writer():
+        for i, l in enumerate(lines):
+            data = (l + '\r\n').encode('ascii')
+            written[i] = monotonic()
+            while data:
+                data = data[os.write(master, data):]
+
+    def handler(line):
+        handled.append(monotonic())
+
+    port = os.fdopen(slave, 'rb', buffering=0)
+    pipeline = LinePipeline(handler, until=end_marker)
+
+    t = threading.Thread(target=writer)
+    start = monotonic()
+    t.start()
+    asyncio.run(pipeline.run(port))
+    t.join()
+    os.close(master)
+
+    latency = [(h - w) * 1e3 for h, w in zip(handled, written)]
+    elapsed = handled[-1] - start
+    p = statistics.quantiles(latency, n=100)
+    print(f"lines:      {len(handled)}")
+    print(f"throughput: {len(handled) / elapsed:.0f} lines/s")
+    print(f"latency:    mean {statistics.mean(latency):.3f} ms, p50 {p[49]:.3f} ms, "
+          f"p99 {p[98]:.3f} ms, max {max(latency):.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a captured serial log through a pty into LinePipeline")
+    parser.add_argument("log", help="log file written by OrangeCrab-tests.py, or a plain serial capture")
+    parser.add_argument("--repeat", type=int, default=100,
+                        help="number of times to replay the log (default=100)")
+    args = parser.parse_args()
+
+    bench(read_serial_log(args.log) * args.repeat)
+
+
+if __name__ == "__main__":
+    main()
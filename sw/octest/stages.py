@@ -0,0 +1,150 @@
+# This file is part of OrangeCrab-test
+# Copyright 2020 Gregory Davill <greg.davill@gmail.com>
+
+# The test flow as a chain of stages, each holding the shared resources it needs.
+#
+# Every DUT runs the chain in its own process. Resources (a JTAG adapter, the
+# operator, a USB bus) are file locks in a directory shared by the station, so
+# a stage starts as soon as its resources are free and the stages of different
+# DUTs overlap wherever they don't compete, e.g. one board flashing its
+# bootloader while the next one runs its self-test.
+
+import os
+import re
+import json
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt   # Windows
+
+from contextlib import contextmanager
+from time import monotonic
+
+
+# stage -> resource kinds held while it runs, in flow order
+FLOW = {
+    "load-test":   ["jtag"],
+    "self-test":   [],
+    "flash-boot":  ["jtag"],
+    "load-reboot": ["jtag"],
+    "operator":    ["operator"],
+    "dfu-load":    ["usb"],
+}
+
+
+def _lock(f):
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return
+    # LK_LOCK gives up after ten tries a second apart, a stage can hold a lock for longer
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            pass
+
+
+def _unlock(f):
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def resource_names(jtag=None, usb_path=None):
+    """Map resource kinds to lock names. Slots with the same adapter or bus share a lock."""
+    names = {"operator": "operator", "jtag": "jtag", "usb": "usb"}
+    if jtag is not None:
+        names["jtag"] = "jtag-" + re.sub(r"[^\w.-]", "_", jtag)
+    if usb_path is not None:
+        names["usb"] = "usb-" + usb_path.split('-')[0]
+    return names
+
+
+class StageRunner:
+    def __init__(self, slot, resources, lock_dir=None, report=None):
+        self.slot = slot
+        self.resources = resources
+        self.lock_dir = lock_dir
+        self.report = report
+        self.records = []
+        self._open = None   # (name, resources, request, start) of the stage running
+
+    def _record(self, name, names, t_request, t_start, t_end):
+        record = dict(slot=self.slot, stage=name, resources=names,
+                      request=t_request, start=t_start, end=t_end)
+        self.records.append(record)
+        if self.report is not None:
+            with open(self.report, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+    def close(self):
+        """End the stage running now, so a verdict reached inside it sees it in ``records``."""
+        if self._open is not None:
+            self._record(*self._open, monotonic())
+            self._open = None
+
+    @contextmanager
+    def stage(self, name):
+        names = sorted(self.resources[k] for k in FLOW[name]) # fixed order, no deadlocks
+        held = []
+        t_request = monotonic()
+        try:
+            if self.lock_dir is not None:
+                os.makedirs(self.lock_dir, exist_ok=True)
+                for r in names:
+                    f = open(os.path.join(self.lock_dir, r + ".lock"), "w")
+                    _lock(f)
+                    held.append(f)
+            self._open = (name, names, t_request, monotonic())
+            yield
+        finally:
+            self.close()
+            for f in reversed(held):
+                _unlock(f)
+                f.close()
+
+
+def read_report(filename):
+    with open(filename, "r") as f:
+        return [json.loads(l) for l in f if l.strip()]
+
+
+def _union(intervals):
+    total = 0.0
+    end = None
+    for s, e in sorted(intervals):
+        if end is None or s > end:
+            total += e - s
+            end = e
+        elif e > end:
+            total += e - end
+            end = e
+    return total
+
+
+def utilization(records):
+    """Text report of per-stage busy/wait time and per-resource utilization."""
+    if not records:
+        return []
+    t0 = min(r["request"] for r in records)
+    makespan = max(r["end"] for r in records) - t0
+
+    lines = [f"  {'stage':12s}{'runs':>6s}{'busy':>9s}{'wait':>9s}{'util':>7s}"]
+    for stage in FLOW:
+        rs = [r for r in records if r["stage"] == stage]
+        if not rs:
+            continue
+        busy = sum(r["end"] - r["start"] for r in rs)
+        wait = sum(r["start"] - r["request"] for r in rs)
+        util = _union([(r["start"], r["end"]) for r in rs]) / makespan
+        lines.append(f"  {stage:12s}{len(rs):6d}{busy:8.1f}s{wait:8.1f}s{util:6.0%}")
+
+    lines.append(f"  {'resource':12s}{'':15s}{'held':>9s}{'util':>7s}")
+    for name in sorted({n for r in records for n in r["resources"]}):
+        held = _union([(r["start"], r["end"]) for r in records if name in r["resources"]])
+        lines.append(f"  {name:12s}{'':15s}{held:8.1f}s{held / makespan:6.0%}")
+    return lines
@@ -0,0 +1,199 @@
+# This file is part of OrangeCrab-test
+# Copyright 2020 Gregory Davill <greg.davill@gmail.com>
+
+# Timing trace of one test run: stages, subprocesses, USB enumeration and the
+# firmware's own Test:<name> phases, all on the host's monotonic clock.
+#
+# A run is written out as Chrome trace-event JSON (open it in chrome://tracing
+# or https://ui.perfetto.dev). Across many runs, the summary breaks the cycle
+# time down by nesting, with percentiles for every span:
+#   python3 -m octest.trace log/trace-*.json
+#   python3 -m octest.trace log/*/trace-*.json --folded cycle.folded
+
+import os
+import re
+import sys
+import json
+import argparse
+import statistics
+
+from contextlib import contextmanager
+from time import monotonic
+
+
+# category -> row in the trace viewer
+THREADS = {
+    "stage":      (0, "stages"),
+    "wait":       (0, "stages"),
+    "subprocess": (1, "host"),
+    "usb":        (1, "host"),
+    "firmware":   (2, "firmware"),
+}
+
+# "Test:SPI-FLASH, Start", "Test:DDR3 Start", "Test:GPIO|Pass", "Test:ADC, Finish"
+MARKER = re.compile(r"Test:([\w-]+)[ ,|]+(\w+)")
+
+
+class Tracer:
+    def __init__(self, name=None):
+        self.name = name
+        self.t0 = monotonic()
+        self.events = []
+        self._open = {}
+
+    def complete(self, name, cat, start, end, **args):
+        self.events.append(dict(name=name, cat=cat, ph="X",
+                                ts=(start - self.t0) * 1e6, dur=(end - start) * 1e6, args=args))
+
+    def instant(self, name, cat, t=None, **args):
+        t = monotonic() if t is None else t
+        self.events.append(dict(name=name, cat=cat, ph="i", s="t", ts=(t - self.t0) * 1e6, args=args))
+
+    def begin(self, name, cat, t=None):
+        self._open[name] = (cat, monotonic() if t is None else t)
+
+    def end(self, name, t=None, **args):
+        if name not in self._open:
+            return False
+        cat, start = self._open.pop(name)
+        self.complete(name, cat, start, monotonic() if t is None else t, **args)
+        return True
+
+    @contextmanager
+    def span(self, name, cat="subprocess", **args):
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.complete(name, cat, start, monotonic(), **args)
+
+    def marker(self, line, t=None):
+        """Turn a firmware Test: line into the start or end of a span."""
+        m = MARKER.match(line)
+        if m is None:
+            return
+        name, word = m.group(1), m.group(2).lower()
+        if word == "start":
+            self.begin(name, "firmware", t)
+        elif not self.end(name, t, result=word):
+            self.instant(name, "firmware", t, result=word)
+
+    def stages(self, records):
+        """Add the stages a StageRunner ran, and how long each waited for its resources."""
+        for r in records:
+            if r["start"] - r["request"] > 1e-3:
+                self.complete(r["stage"] + " wait", "wait", r["request"], r["start"], resources=r["resources"])
+            self.complete(r["stage"], "stage", r["start"], r["end"])
+
+    def write(self, filename):
+        # Anything still open was cut short by a failure
+        now = monotonic()
+        for name in list(self._open):
+            self.end(name, now, incomplete=True)
+
+        pid = os.getpid()
+        events = [dict(name="process_name", ph="M", pid=pid, args=dict(name=self.name or "dut"))]
+        for tid, thread in sorted(set(THREADS.values())):
+            events.append(dict(name="thread_name", ph="M", pid=pid, tid=tid, args=dict(name=thread)))
+        for e in self.events:
+            events.append(dict(e, pid=pid, tid=THREADS[e["cat"]][0]))
+
+        with open(filename, "w") as f:
+            json.dump(dict(traceEvents=events, displayTimeUnit="ms"), f)
+
+
+# Summary ------------------------------------------------------------------------------------------
+
+def read_trace(filename):
+    with open(filename, "r") as f:
+        events = json.load(f)["traceEvents"]
+    return [e for e in events if e.get("ph") == "X"]
+
+
+def stacks(events):
+    """(stack, duration in s) for every span, the stack being the names of the spans enclosing it."""
+    out = []
+    open_spans = []
+    # Parents sort before the children they contain
+    for e in sorted(events, key=lambda e: (e["ts"], -e["dur"])):
+        # 1us of slack for rounding, stages that follow each other must not nest
+        while open_spans and e["ts"] + e["dur"] > open_spans[-1]["ts"] + open_spans[-1]["dur"] + 1:
+            open_spans.pop()
+        open_spans.append(e)
+        out.append((tuple(s["name"] for s in open_spans), e["dur"] / 1e6))
+    return out
+
+
+def summary(runs):
+    """Report lines with the percentiles of each span across runs, nested like a flame graph."""
+    durations = {}
+    for events in runs:
+        per_run = {}
+        for stack, dur in stacks(events):
+            per_run[stack] = per_run.get(stack, 0) + dur
+        for stack, dur in per_run.items():
+            durations.setdefault(stack, []).append(dur)
+
+    cycle = statistics.mean(sum(e["dur"] for e in events if e["cat"] in ("stage", "wait")) / 1e6
+                            for events in runs)
+
+    width = max(2 * len(s) + len(s[-1]) for s in durations)
+    lines = [f"{len(runs)} runs, mean cycle {cycle:.2f}s",
+             f"  {'span':{width}s}{'n':>6s}{'p50':>9s}{'p90':>9s}{'p99':>9s}{'max':>9s}{'share':>7s}"]
+
+    def children(parent):
+        kids = [s for s in durations if len(s) == len(parent) + 1 and s[:-1] == parent]
+        return sorted(kids, key=lambda s: -statistics.mean(durations[s]))
+
+    def walk(parent):
+        for stack in children(parent):
+            d = sorted(durations[stack])
+            p = statistics.quantiles(d, n=100, method="inclusive") if len(d) > 1 else d * 99
+            share = sum(d) / len(runs) / cycle if cycle else 0
+            name = "  " * (len(stack) - 1) + stack[-1]
+            lines.append(f"  {name:{width}s}{len(d):6d}{p[49]:8.2f}s{p[89]:8.2f}s{p[98]:8.2f}s{d[-1]:8.2f}s"
+                         f"{share:6.0%} " + "#" * round(40 * share))
+            walk(stack)
+
+    walk(())
+    return lines
+
+
+def folded(runs):
+    """Mean self time of each stack, in the folded format of flamegraph.pl / speedscope (ms)."""
+    total = {}
+    for events in runs:
+        for stack, dur in stacks(events):
+            total[stack] = total.get(stack, 0) + dur
+            if len(stack) > 1:
+                total[stack[:-1]] = total.get(stack[:-1], 0) - dur
+    return [f"{';'.join(s)} {max(0, round(t / len(runs) * 1e3))}" for s, t in sorted(total.items())]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize OrangeCrab test traces across runs")
+    parser.add_argument("traces", nargs="+", help="trace-*.json files written by OrangeCrab-tests.py")
+    parser.add_argument("--folded", default=None,
+                        help="also write folded stacks for a flame graph to this file")
+    args = parser.parse_args()
+
+    runs = []
+    for filename in args.traces:
+        try:
+            runs.append(read_trace(filename))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"{filename}: {e}", file=sys.stderr)
+    if not runs:
+        sys.exit("no traces")
+
+    for l in summary(runs):
+        print(l)
+
+    if args.folded is not None:
+        with open(args.folded, "w") as f:
+            for l in folded(runs):
+                f.write(l + "\n")
+
+
+if __name__ == "__main__":
+    main()